@@ -13,6 +13,7 @@ from utils.tgraph import getTestTGraph, getTestTGraphErrors, \
 from utils.toNumpy import getAsNumpy
 from utils.toPandas import getAsPandas
 from utils.misc import getN
+from utils.arrayEff import ArrayEff
 
 
 
@@ -109,9 +110,19 @@ class DdfEff:
         StatOption: str = "Clopper Pearson",
         CL: float = 0.682689,
         Name: Union[str, None] = None,
-        Title: Union[str, None] = None
+        Title: Union[str, None] = None,
+        Array: Union[ArrayEff, None] = None
     ):
-        if TEfficiency:
+        if Array is not None:
+            # ROOT objects (TEfficiency, Passed, Total) are built on first access, see __getattr__
+            self.Array = Array
+            self.Dim = Array.Dim
+            self.StatOption = Array.StatOption
+            self.CL = Array.CL
+            self.Name = Array.Name
+            self.Title = Array.Title
+
+        elif TEfficiency:
             self.Passed = TEfficiency.GetPassedHistogram()
             self.Total = TEfficiency.GetTotalHistogram()
             self.Dim = TEfficiency.GetDimension()
@@ -130,13 +141,41 @@ class DdfEff:
             self.__dict__.update(self.impl.__dict__)
 
         else:
-            raise ValueError("Either TEfficiency or Passed/Total histograms must be provided!")
-
+            raise ValueError("Either TEfficiency, Passed/Total histograms or an ArrayEff must be provided!")
+
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not set yet: materialize the
+        # ROOT objects of an array-backed efficiency or the array of a ROOT one
+        attrs = self.__dict__
+        if name == "TEfficiency" and "Array" in attrs:
+            attrs["TEfficiency"] = attrs["Array"].ToTEfficiency()
+            return attrs["TEfficiency"]
+
+        if name in ("Passed", "Total") and "Array" in attrs:
+            attrs["Passed"] = self.TEfficiency.GetPassedHistogram()
+            attrs["Total"] = self.TEfficiency.GetTotalHistogram()
+            return attrs[name]
+
+        if name == "Array" and "TEfficiency" in attrs:
+            if "StatOption" in attrs:
+                attrs["Array"] = ArrayEff.FromHists(
+                    attrs["Passed"], attrs["Total"], attrs["StatOption"], attrs["CL"], attrs.get("Name"), attrs.get("Title")
+                )
+            else:
+                attrs["Array"] = ArrayEff.FromTEfficiency(attrs["TEfficiency"])
+            return attrs["Array"]
 
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
 
 
     def GetGraph(self):
-        return self.impl.GetGraph()
+        if "impl" in self.__dict__:
+            return self.impl.GetGraph()
+        return self.Array.ToGraph()
+
+    def GetEffWithErrors(self) -> tuple:
+        return self.Array.GetEffWithErrors()
 
     def GetTH2(self) -> ROOT.TH2:
         return getHistFromTEff2D(self.TEfficiency, self.Name, self.Title)
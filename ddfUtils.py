@@ -1,24 +1,87 @@
-import os, glob
+import os, re, glob
 import numpy as np
 from time import time
 from typing import Union
+from concurrent.futures import ThreadPoolExecutor
 from scipy.stats import beta, norm
 from scipy.optimize import root_scalar
+from utils.flux import getFluxWithAllVariances as _getFluxWithAllVariances
+from utils.intervals import getEffIntervals
+from utils.cache import getCacheDir
+
+
+# Directory names we descend into when looking for a run directory: years
+# (e.g. 2023) and run groupings (e.g. run_2412).
+LAYOUT_PATTERNS = (r'\d{4}', r'run_\d{4}')
+
+
+def _listSubDirs(path: str) -> list:
+    try:
+        with os.scandir(path) as it:
+            return [d.path for d in it if d.is_dir(follow_symlinks=False)]
+    except OSError:
+        return []
 
 
 def getSubDirPath(
-    TopDir:  str,
-    RootDir: str = "/eos/experiment/sndlhc/convertedData/physics"
+    TopDir:    str,
+    RootDir:   str = "/eos/experiment/sndlhc/convertedData/physics",
+    firstOnly: bool = False,
+    nThreads:  int = 8,
+    prune:     bool = False
 ):
     """
     Return a list of full paths to subdirectories named `TopDir`,
-    starting from `root_path`.
+    starting from `RootDir`.
+
+    The tree is scanned level by level with `os.scandir`, listing sibling
+    directories concurrently.
+
+    Pruning is opt-in and meant for looking up a run directory in the
+    `YYYY/run_NNNN` layout: only directories matching `LAYOUT_PATTERNS`
+    are descended into (and not the matches themselves), so matches outside
+    the layout are not returned. If the pruned scan finds nothing, the full
+    tree is scanned, so a missing directory costs both scans.
+
+    Args:
+        TopDir: Name of the directory to look for
+        RootDir: Directory to start the search from
+        firstOnly: Stop at the first level with a match and return only the first match
+        nThreads: Number of threads listing directories concurrently
+        prune: Descend only into known layout directories first (see above)
+
+    Returns:
+        list: Paths of the matching directories
     """
+    patterns = [re.compile(p) for p in LAYOUT_PATTERNS]
 
     matchingDirs = []
-    for dirpath, dirnames, _ in os.walk(RootDir):
-        if os.path.basename(dirpath) == TopDir:
-            matchingDirs.append(dirpath)
+    if os.path.basename(os.path.normpath(RootDir)) == TopDir:
+        matchingDirs.append(RootDir)
+        if firstOnly:
+            return matchingDirs
+
+    level = [RootDir]
+    with ThreadPoolExecutor(max_workers=nThreads) as executor:
+        while level:
+            nextLevel = []
+            for subDirs in executor.map(_listSubDirs, level):
+                for subDir in subDirs:
+                    name = os.path.basename(subDir)
+                    if name == TopDir:
+                        matchingDirs.append(subDir)
+                        if prune:
+                            continue
+                    if not prune or any(p.fullmatch(name) for p in patterns):
+                        nextLevel.append(subDir)
+
+            if firstOnly and matchingDirs:
+                return matchingDirs[:1]
+            level = nextLevel
+
+    if prune and not matchingDirs:
+        return getSubDirPath(TopDir, RootDir, firstOnly, nThreads, prune=False)
+
     return matchingDirs
 
 def getAllFiles(inputDir: str, files: str) -> list:
@@ -182,9 +245,9 @@ def getEffWithError(
     Calculate efficiency and errors using specified statistical method.
 
     Args:
-        passed: Number of successes
-        total: Total number of trials
-        statOption: Statistical method to use ('Clopper Pearson' or 'Bayesian')
+        passed: Number of successes (scalar or array)
+        total: Total number of trials (scalar or array)
+        statOption: Statistical method to use (any TEfficiency option, see utils.intervals)
         cl: Confidence level (default is 1-sigma)
 
     Returns:
@@ -193,21 +256,10 @@ def getEffWithError(
     Raises:
         ValueError: If invalid statistical method is specified
     """
-    statOption = statOption.lower()
-
-    clopper_pearson_options = {"clopper_pearson", "kfcp", "clopper pearson",
-                               "clopper-pearson", "clopper.pearson",
-                               "clopper:pearson", "clopperpearson"}
-    bayesian_options = {"bayesian", "kbbayesian"}
-    allowed_options = clopper_pearson_options | bayesian_options  # Combine sets using union operator
-
-    if statOption in clopper_pearson_options:
-        eff, deff_up, deff_low = getClopperPearsonInterval(passed, total, cl=cl)
-    elif statOption in bayesian_options:  # Use bayesian_options directly here
-        eff, deff_up, deff_low = getBayesianInterval(passed, total, cl=cl)
-    else:
-        raise ValueError(f"Invalid statistic option '{statOption}'! Allowed options are: {', '.join(allowed_options)}")
+    eff, deff_up, deff_low = getEffIntervals(passed, total, statOption=statOption, cl=cl)
 
+    if np.ndim(passed) == 0 and np.ndim(total) == 0:
+        return float(eff), float(deff_up), float(deff_low)
     return eff, deff_up, deff_low
 
 
@@ -254,63 +306,93 @@ def getSystematicVarianceChi2Method(x, statVariances, sysVariances):
 
 
 
+def getSystematicVariancesChi2Method(
+    x,
+    statVariances,
+    sysVariances,
+    groups = None,
+    tol: float = 1e-10,
+    maxIter: int = 100
+) -> tuple:
+    """
+    Batched getSystematicVarianceChi2Method: the extra variance s^2 per group
+    for which chi2/ndf of the weighted mean equals 1, solved for all groups
+    at once with safeguarded Newton steps (falling back to bisection).
+
+    Args:
+        x: Values, either flat (with `groups`) or a list of per-group sequences
+        statVariances: Statistical variances, same layout as `x`
+        sysVariances: Systematic variances, same layout as `x`
+        groups: Group label of each value (e.g. year, fill or track type)
+        tol: Relative tolerance on s^2
+        maxIter: Maximum number of iterations
+
+    Returns:
+        tuple: (group labels, s^2 per group, converged flag per group)
+    """
+    if groups is None:
+        groups = np.repeat(np.arange(len(x)), [len(g) for g in x])
+        x, statVariances, sysVariances = (
+            np.concatenate([np.asarray(g, dtype=np.float64) for g in a]) if len(a) else np.array([])
+            for a in (x, statVariances, sysVariances)
+        )
+
+    x = np.asarray(x, dtype=np.float64)
+    xVar = np.asarray(statVariances, dtype=np.float64) + np.asarray(sysVariances, dtype=np.float64)
+    labels, idx = np.unique(np.asarray(groups), return_inverse=True)
+    nGroups = len(labels)
+
+    def groupSum(values):
+        return np.bincount(idx, weights=values, minlength=nGroups)
+
+    N = np.bincount(idx, minlength=nGroups)
+    ndf = N - 1
+
+    def getChi2(s2):
+        weights = 1 / (xVar + s2[idx])
+        xHat = groupSum(x * weights) / groupSum(weights)
+        residuals2 = (x - xHat[idx])**2
+        # d(chi2)/d(s2) at fixed xHat, which is exact since xHat minimizes chi2
+        return groupSum(residuals2 * weights) - ndf, -groupSum(residuals2 * weights**2)
+
+    # Same bracket as the scalar method: s in [0, 10*std + 0.01]
+    mean = groupSum(x) / np.maximum(N, 1)
+    std = np.sqrt(groupSum((x - mean[idx])**2) / np.maximum(N, 1))
+    lo = np.zeros(nGroups)
+    hi = (10 * std + 0.01)**2
+
+    gLo, _ = getChi2(lo)
+    gHi, _ = getChi2(hi)
+    solvable = (ndf > 0) & (gLo > 0) & (gHi < 0)
+
+    s2 = np.zeros(nGroups)
+    converged = (ndf > 0) & ~solvable & (gLo <= 0)
+    active = solvable.copy()
+
+    for _ in range(maxIter):
+        if not active.any():
+            break
+
+        g, dg = getChi2(s2)
+        lo = np.where(active & (g > 0), s2, lo)
+        hi = np.where(active & (g < 0), s2, hi)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            step = s2 - g / dg
+        bisect = ~np.isfinite(step) | (step <= lo) | (step >= hi)
+        s2New = np.where(bisect, 0.5 * (lo + hi), step)
+
+        done = active & ((g == 0) | (np.abs(s2New - s2) <= tol * np.maximum(s2New, tol)) | (hi - lo <= tol * np.maximum(hi, tol)))
+        s2 = np.where(active, s2New, s2)
+        converged |= done
+        active &= ~done
+
+    return labels, s2, converged
+
+
+
 
 def getFluxWithAllVariances(
     fluxes, fluxStatVars, fluxSysLVars, fluxSysEffVars, rhoL: float = 0, rhoEff: float = 0.8
 ):
-    fluxes = np.asarray(fluxes)
-    N = len(fluxes)
-
-    fluxStatVars = np.asarray(fluxStatVars)
-    fluxSysLVars = np.asarray(fluxSysLVars)
-    fluxSysEffVars = np.asarray(fluxSysEffVars)
-
-    fluxStatSigmas = np.sqrt(fluxStatVars)
-    fluxSysLSigmas = np.sqrt(fluxSysLVars)
-    fluxSysEffSigmas = np.sqrt(fluxSysEffVars)
-
-    # Combine systematic variances
-    fluxSysVars = fluxSysLVars + fluxSysEffVars
-    fluxSysSigmas = np.sqrt(fluxSysVars)
-
-    # Construct total covariance matrix
-    covMat = np.zeros((N, N))
-    for i in range(N):
-        for j in range(N):
-            cov = 0.0
-            if i == j:
-                cov = fluxStatVars[i] + fluxSysVars[i]
-            else:
-                cov += rhoEff * fluxSysEffSigmas[i] * fluxSysEffSigmas[j]
-                cov += rhoL   * fluxSysLSigmas[i] * fluxSysLSigmas[j]
-            covMat[i, j] = cov
-
-    covMatInv = inv(covMat)
-
-    ones = np.ones(N)
-    meanFlux = (ones @ covMatInv @ fluxes) / (ones @ covMatInv @ ones)
-    fluxVar = 1 / (ones @ covMatInv @ ones)
-
-    chi2 = (fluxes - meanFlux) @ covMatInv @ (fluxes - meanFlux)
-    pVal = 1 - chi2_dist.cdf(chi2, df=N - 1)
-
-    def f(s2):
-        denom = fluxStatVars + fluxSysVars + s2
-        weighted_mean = np.sum(fluxes / denom) / np.sum(1 / denom)
-        return np.sum(((fluxes - weighted_mean)**2) / denom) - (N - 1)
-
-    try:
-        sysMethodVar = brentq(f, 0, 1e10)
-    except ValueError:
-        sysMethodVar = 0.0
-
-    return {
-        "flux": meanFlux,
-        "stat": fluxVar,
-        "sysL": np.max(fluxSysLVars),
-        "sysEff": np.max(fluxSysEffVars),
-        "sysMethod": sysMethodVar
-    }, {
-        "chi2": chi2,
-        "pVal": pVal
-    }
+    return _getFluxWithAllVariances(fluxes, fluxStatVars, fluxSysLVars, fluxSysEffVars, rhoL=rhoL, rhoEff=rhoEff)
@@ -5,11 +5,17 @@ import pandas as pd
 import glob
 from datetime import datetime
 from typing import Union
-from SndlhcGeo import GeoInterface
+from concurrent.futures import ThreadPoolExecutor
 from ddfUtils import getSubDirPath, getAllFiles
+from utils.catalog import getFileEntries
+from utils.columnar import iterateEvents, countTracks
+from utils.parallel import processFiles, processShards, getShards
+from utils.rdf import getRDataFrame
+from utils.flux import getFluxWithAllVariances as _getFluxWithAllVariances
+from utils.geo import getGeoInterface, initAlignment, getAlignmentPeriod
 from utils.tracks import sys, alg, system, algorithm, att
 from utils.misc import nType, nName, getTChain, getTtFromSys, sfTrackIsReconstructible, dsTrackIsReconstructible, thereIsAMuon, getN
-from utils.misc import getN, getFill, getRuns, getRunYear, getRunDate, getLumi
+from utils.misc import getN, getFill, getRuns, getRunYear, getRunDate, getLumi, getRunMetadata
 
 
 class SndData:
@@ -27,110 +33,109 @@ class SndData:
         else:
             self.Files = f"{Files}.root"
 
+        prune = TopDir is None
         if TopDir is None:
             TopDir = f"run_{Run:06d}"
         else:
             TopDir = TopDir
-        print(getSubDirPath(TopDir=TopDir, RootDir=InputDir)[0])
-        self.InputDir = getSubDirPath(TopDir=TopDir, RootDir=InputDir)[0]
+        self.InputDir = getSubDirPath(TopDir=TopDir, RootDir=InputDir, firstOnly=True, prune=prune)[0]
+        print(self.InputDir)
 
+        self.Metadata = getRunMetadata(self.InputDir, self.Files)
         self.Date = self.GetDate()
         self.Fill = self.GetFill()
-        self.Tree = self.GetTChain(getSubDirPath(TopDir=TopDir, RootDir=InputDir)[0], Files)
+        self.Tree = self.GetTChain(self.InputDir, self.Files)
+        self.SetGeo(Geofile)
 
+        print(f"Run {Run} was successfully initialized.")
+
+
+    def SetGeo(self, Geofile: Union[str, None]):
         if Geofile:
             self.Geofile = Geofile
-            self.GeoInterface = GeoInterface(Geofile)
-            self.Scifi = GeoInterface(Geofile).modules["Scifi"]
-            self.Mufi = GeoInterface(Geofile).modules["MuFilter"]
+            self.GeoInterface = getGeoInterface(Geofile)
+            self.Scifi = self.GeoInterface.modules["Scifi"]
+            self.Mufi = self.GeoInterface.modules["MuFilter"]
         else:
             self.Geofile = None
             self.GeoInterface = None
             self.Scifi = None
             self.Mufi = None
 
-        print(f"Run {Run} was successfully initialized.")
-
-
     def SetInputDir(self):
-        self.InputDir = getSubDirPath(TopDir=f"run_{self.Run:06d}", RootDir=self.InputDir)[0]
+        self.InputDir = getSubDirPath(TopDir=f"run_{self.Run:06d}", RootDir=self.InputDir, firstOnly=True, prune=True)[0]
+        self.Metadata = getRunMetadata(self.InputDir, self.Files)
 
     def GetDate(self) -> datetime:
-        try:
-            file_ = self.GetAllFiles()[0]
-            tfile = ROOT.TFile.Open(file_)
-        except Exception as e:
-            print(f"Error opening file: {e}")
-            return None
-        if tfile.Get("cbmsim"):
-            ttree = tfile.Get("cbmsim")
-        elif tfile.Get("rawConv"):
-            ttree = tfile.Get("rawConv")
-        else:
-            raise ValueError("No tree of name cbmsim/rawConv was found!")
-
-        try:
-            ttree.GetEntry(0)
-            utc_timestamp = ttree.EventHeader.GetUTCtimestamp()
-            date_ = datetime.utcfromtimestamp(utc_timestamp)
-            return date_
-        except Exception as e:
-            print(f"Error accessing data: {e}")
-            return None
+        return self.Metadata["date"]
 
     def GetFill(self) -> int:
-        try:
-            file_ = self.GetAllFiles()[0]
-            tfile = ROOT.TFile.Open(file_)
-        except Exception as e:
-            print(f"Error opening file: {e}")
-            return None
-        if tfile.Get("cbmsim"):
-            ttree = tfile.Get("cbmsim")
-        elif tfile.Get("rawConv"):
-            ttree = tfile.Get("rawConv")
-        else:
-            return None
-
-        try:
-            ttree.GetEntry(0)
-            return int(ttree.EventHeader.GetFillNumber())
-        except Exception as e:
-            print(f"Error accessing data: {e}")
-            return None
+        return self.Metadata["fill"]
 
     def GetTChain(self, InputDir: str, Files: str) -> ROOT.TChain:
-        try:
-            file_ = self.GetAllFiles()[0]
-            tfile = ROOT.TFile.Open(file_)
-        except Exception as e:
-            print(f"Error opening file: {e}")
+        if self.Metadata["tree"] is None:
             return None
 
-        if tfile.Get("cbmsim"):
-            tchain = ROOT.TChain("cbmsim")
-        elif tfile.Get("rawConv"):
-            tchain = ROOT.TChain("rawConv")
-        else: return None
-
+        tchain = ROOT.TChain(self.Metadata["tree"])
         tchain.Add(f"{InputDir}/{Files}")
         return tchain
 
 
 
     def GetAllFiles(self) -> list:
-        return getAllFiles(self.InputDir, self.Files)
+        return list(self.Metadata["files"])
 
     def GetInput(self) -> str:
         return f"{self.InputDir}/{self.Files}"
 
-    def InitGeo(self):
+    def GetFileTrees(self) -> dict:
+        return {file_: self.Metadata["tree"] for file_ in self.GetAllFiles()}
+
+    def IterateArrays(self,
+        Groups: tuple = ("header",),
+        StepSize: Union[int, str] = "100 MB",
+        EntryStart: Union[int, None] = None,
+        EntryStop: Union[int, None] = None
+    ):
+        return iterateEvents(self.GetFileTrees(), groups=Groups, stepSize=StepSize,
+                             entryStart=EntryStart, entryStop=EntryStop)
+
+    def GetRDataFrame(self, nThreads: Union[int, None] = None) -> ROOT.RDataFrame:
+        return getRDataFrame(self.Tree, nThreads)
+
+    def ProcessFiles(self,
+        Function,
+        nWorkers: Union[int, None] = None,
+        CheckpointDir: Union[str, None] = None
+    ):
+        return processFiles(Function, self.GetFileTrees(), nWorkers=nWorkers, checkpointDir=CheckpointDir)
+
+    def GetShards(self, nShards: Union[int, None] = None, ShardSize: Union[int, None] = None) -> list:
+        return getShards(self.Tree.GetEntries(), nShards, ShardSize)
+
+    def ProcessShards(self,
+        Function,
+        nShards: Union[int, None] = None,
+        ShardSize: Union[int, None] = None,
+        CheckpointDir: Union[str, None] = None,
+        nWorkers: Union[int, None] = None
+    ):
+        return processShards(Function, self.GetShards(nShards, ShardSize), checkpointDir=CheckpointDir, nWorkers=nWorkers)
+
+    def GetTrackCounts(self, StepSize: Union[int, str] = "100 MB") -> dict:
+        nTracks = {tt: 0 for tt in (1, 11, 3, 13)}
+        for chunk in self.IterateArrays(Groups=("tracks",), StepSize=StepSize):
+            for tt, counts in countTracks(chunk).items():
+                nTracks[tt] += int(counts.sum())
+        return nTracks
+
+    def InitGeo(self, force: bool = False):
         if not (self.Scifi and self.Mufi):
             raise ValueError("Geo modules for Scifi and DS are not valid or are not provided!")
 
-        self.Tree.GetEntry(0)
-        self.Scifi.InitEvent(self.Tree.EventHeader)
-        self.Mufi.InitEvent(self.Tree.EventHeader)
+        # Another geofile may have been loaded into gGeoManager since SetGeo
+        self.SetGeo(self.Geofile)
+        initAlignment(self.GeoInterface, self.Tree, self.Run, force=force)
 
     def Print(self):
         print("SND@LHC Dataset:")
@@ -146,6 +151,174 @@ class SndData:
 
 
 
+class SndRunSet(SndData):
+    """
+    One dataset spanning many runs.
+
+    Run directories and metadata of all runs are resolved concurrently at
+    construction; the TChain over all files is only built when `Tree` is
+    first accessed. Per-file and per-run entry offsets map any global entry
+    back to its run, fill and file.
+    """
+
+    def __init__(self,
+        Runs: list,
+        InputDir: str = "/eos/experiment/sndlhc/convertedData/physics",
+        Files: str = "sndsw_raw-*",
+        Geofile: Union[str, None] = None,
+        nThreads: int = 8
+    ):
+        self.Runs = sorted(int(run) for run in Runs)
+        if not self.Runs:
+            raise ValueError("No runs were provided!")
+        self.Run = self.Runs[0]
+        self.RootDir = InputDir
+
+        if Files.endswith(".root"):
+            self.Files = Files
+        else:
+            self.Files = f"{Files}.root"
+
+        def getRunDir(run: int) -> str:
+            return getSubDirPath(TopDir=f"run_{run:06d}", RootDir=InputDir, firstOnly=True, prune=True)[0]
+
+        ROOT.EnableThreadSafety()
+        with ThreadPoolExecutor(max_workers=nThreads) as executor:
+            self.RunDirs = dict(zip(self.Runs, executor.map(getRunDir, self.Runs)))
+            self.RunMetadata = dict(zip(
+                self.Runs,
+                executor.map(lambda run: getRunMetadata(self.RunDirs[run], self.Files), self.Runs)
+            ))
+
+        self.InputDir = self.RunDirs[self.Run]
+        self.Metadata = self.RunMetadata[self.Run]
+        self.Fills = {run: metadata["fill"] for run, metadata in self.RunMetadata.items()}
+        self.Date = self.GetDate()
+        self.Fill = self.GetFill()
+
+        self._tree = None
+        self._fileOffsets = None
+        self.SetGeo(Geofile)
+
+        print(f"Runs {self.Runs[0]}-{self.Runs[-1]} ({len(self.Runs)} runs) were successfully initialized.")
+
+
+    def SetInputDir(self):
+        raise ValueError("The input directories of a SndRunSet are fixed at construction!")
+
+    def InitGeo(self, force: bool = False, Run: Union[int, None] = None):
+        """
+        Initialize the alignment for `Run` from its first event. When the
+        runs span several alignment periods, call it with the run of the
+        current entry (e.g. Locate(entry)["run"]) while iterating; the
+        alignment is only re-initialized when the period changes.
+        """
+        if not (self.Scifi and self.Mufi):
+            raise ValueError("Geo modules for Scifi and DS are not valid or are not provided!")
+
+        if Run is None:
+            if len({getAlignmentPeriod(run) for run in self.Runs}) > 1:
+                raise ValueError("The runs span several alignment periods, initialize the alignment per run with InitGeo(Run=...)!")
+            Run = self.Run
+
+        runOffsets = self.GetRunOffsets()
+        if Run not in runOffsets:
+            raise ValueError(f"Run {Run} has no events in this run set!")
+
+        # Another geofile may have been loaded into gGeoManager since SetGeo
+        self.SetGeo(self.Geofile)
+        initAlignment(self.GeoInterface, self.Tree, Run, force=force, entry=runOffsets[Run])
+
+    def GetDate(self, Run: Union[int, None] = None) -> datetime:
+        return self.RunMetadata[self.Run if Run is None else Run]["date"]
+
+    def GetFill(self, Run: Union[int, None] = None) -> int:
+        return self.RunMetadata[self.Run if Run is None else Run]["fill"]
+
+    def _getFileIndex(self) -> list:
+        return [
+            (run, file_) for run in self.Runs if self.RunMetadata[run]["tree"] is not None
+            for file_ in self.RunMetadata[run]["files"]
+        ]
+
+    def GetFileRuns(self) -> list:
+        return [run for run, _ in self._getFileIndex()]
+
+    def GetAllFiles(self) -> list:
+        return [file_ for _, file_ in self._getFileIndex()]
+
+    def GetFileTrees(self) -> dict:
+        return {file_: self.RunMetadata[run]["tree"] for run, file_ in self._getFileIndex()}
+
+    def GetInput(self) -> str:
+        return f"{self.RootDir}/run_{{{self.Runs[0]:06d}..{self.Runs[-1]:06d}}}/{self.Files}"
+
+    def GetTChain(self, InputDir: Union[str, None] = None, Files: Union[str, None] = None) -> ROOT.TChain:
+        tchain = None
+        for run, file_ in self._getFileIndex():
+            treeName = self.RunMetadata[run]["tree"]
+            if tchain is None:
+                tchain = ROOT.TChain(treeName)
+            tchain.Add(f"{file_}/{treeName}")
+        return tchain
+
+    @property
+    def Tree(self) -> ROOT.TChain:
+        if self._tree is None:
+            self._tree = self.GetTChain()
+        return self._tree
+
+
+    def GetFileOffsets(self) -> np.ndarray:
+        """
+        Return the global entry at which each file starts, with the total
+        number of entries appended.
+        """
+        if self._fileOffsets is None:
+            entries = getFileEntries(self.GetFileTrees())
+            counts = [entries[file_] for file_ in self.GetAllFiles()]
+            self._fileOffsets = np.concatenate(([0], np.cumsum(counts, dtype=np.int64)))
+        return self._fileOffsets
+
+    def GetRunOffsets(self) -> dict:
+        fileOffsets = self.GetFileOffsets()
+        runOffsets = {}
+        for i, run in enumerate(self.GetFileRuns()):
+            runOffsets.setdefault(run, int(fileOffsets[i]))
+        return runOffsets
+
+    def Locate(self, entry: int) -> dict:
+        """
+        Map a global entry of `Tree` to its run, fill, file and entry within that file.
+        """
+        fileOffsets = self.GetFileOffsets()
+        if entry < 0 or entry >= fileOffsets[-1]:
+            raise ValueError(f"Entry {entry} is out of range [0, {fileOffsets[-1]})!")
+
+        iFile = int(np.searchsorted(fileOffsets, entry, side="right") - 1)
+        run, file_ = self._getFileIndex()[iFile]
+        return {
+            "run": run,
+            "fill": self.Fills[run],
+            "file": file_,
+            "entry": int(entry - fileOffsets[iFile])
+        }
+
+    def Print(self):
+        print("SND@LHC Run Set:")
+        print(f" > Runs:    {len(self.Runs)} ({self.Runs[0]}-{self.Runs[-1]})")
+        print(f" > Fills:   {sorted(set(f for f in self.Fills.values() if f is not None))}")
+        print(f" > Input:   {self.GetInput()}")
+        print(f" > Files:   {len(self.GetAllFiles()):,}")
+        if self._tree is not None:
+            print(f" > Entries: {self.Tree.GetEntries():,}")
+
+        if self.GeoInterface:
+            print(f" > Geofile: {self.Geofile}")
+
+
+
+
 class SndMCData:
     def __init__(self,
         InputDir: str,
@@ -157,13 +330,16 @@ class SndMCData:
             self.Files = Files
         else:
             self.Files = f"{Files}.root"
-        self.Tree = self.GetTChain(InputDir, Files)
+        self.Metadata = getRunMetadata(self.InputDir, self.Files)
+        self.Tree = self.GetTChain(self.InputDir, self.Files)
+        self.SetGeo(Geofile)
 
+    def SetGeo(self, Geofile: Union[str, None]):
         if Geofile:
             self.Geofile = Geofile
-            self.GeoInterface = GeoInterface(Geofile)
-            self.Scifi = GeoInterface(Geofile).modules["Scifi"]
-            self.Mufi = GeoInterface(Geofile).modules["MuFilter"]
+            self.GeoInterface = getGeoInterface(Geofile)
+            self.Scifi = self.GeoInterface.modules["Scifi"]
+            self.Mufi = self.GeoInterface.modules["MuFilter"]
         else:
             self.Geofile = None
             self.GeoInterface = None
@@ -172,40 +348,58 @@ class SndMCData:
 
     def SetInputDir(self, InputDir: str):
         self.InputDir = InputDir
+        self.Metadata = getRunMetadata(self.InputDir, self.Files)
 
     def GetTChain(self, InputDir: str, Files: str) -> ROOT.TChain:
-        try:
-            file_ = self.GetAllFiles()[0]
-            tfile = ROOT.TFile.Open(file_)
-        except Exception as e:
-            print(f"Error opening file: {e}")
-            return None
-
-        if tfile.Get("cbmsim"):
-            tchain = ROOT.TChain("cbmsim")
-        elif tfile.Get("rawConv"):
-            tchain = ROOT.TChain("rawConv")
-        else:
+        if self.Metadata["tree"] is None:
             return None
 
+        tchain = ROOT.TChain(self.Metadata["tree"])
         tchain.Add(f"{InputDir}/{Files}")
         return tchain
 
 
     def GetAllFiles(self) -> list:
-        return glob.glob(f"{self.InputDir}/{self.Files}")
+        return list(self.Metadata["files"])
 
     def GetInput(self) -> str:
         return f"{self.InputDir}/{self.Files}"
 
+    def GetFileTrees(self) -> dict:
+        return {file_: self.Metadata["tree"] for file_ in self.GetAllFiles()}
+
+    def IterateArrays(self,
+        Groups: tuple = ("header",),
+        StepSize: Union[int, str] = "100 MB",
+        EntryStart: Union[int, None] = None,
+        EntryStop: Union[int, None] = None
+    ):
+        return iterateEvents(self.GetFileTrees(), groups=Groups, stepSize=StepSize,
+                             entryStart=EntryStart, entryStop=EntryStop)
+
 
-    def InitGeo(self):
+    def InitGeo(self, force: bool = False):
         if not (self.Scifi and self.Mufi):
             raise ValueError("Geo modules for Scifi and DS are not valid or are not provided!")
 
-        self.Tree.GetEntry(0)
-        self.Scifi.InitEvent(self.Tree.EventHeader)
-        self.Mufi.InitEvent(self.Tree.EventHeader)
+        # Another geofile may have been loaded into gGeoManager since SetGeo
+        self.SetGeo(self.Geofile)
+        initAlignment(self.GeoInterface, self.Tree, force=force)
+
+    def GetRDataFrame(self, nThreads: Union[int, None] = None) -> ROOT.RDataFrame:
+        return getRDataFrame(self.Tree, nThreads)
+
+    def GetShards(self, nShards: Union[int, None] = None, ShardSize: Union[int, None] = None) -> list:
+        return getShards(self.Tree.GetEntries(), nShards, ShardSize)
+
+    def ProcessShards(self,
+        Function,
+        nShards: Union[int, None] = None,
+        ShardSize: Union[int, None] = None,
+        CheckpointDir: Union[str, None] = None,
+        nWorkers: Union[int, None] = None
+    ):
+        return processShards(Function, self.GetShards(nShards, ShardSize), checkpointDir=CheckpointDir, nWorkers=nWorkers)
 
     def Print(self):
         print("SND@LHC MC Dataset:")
@@ -665,57 +859,4 @@ def getHitDensityWeight(sfHit, event, scifi):
 def getFluxWithAllVariances(
     fluxes, fluxStatVars, fluxSysLVars, fluxSysEffVars, rhoEff: float = 0, rhoL: float = 1
 ):
-    fluxes = np.asarray(fluxes)
-    N = len(fluxes)
-
-    fluxStatVars = np.asarray(fluxStatVars)
-    fluxSysLVars = np.asarray(fluxSysLVars)
-    fluxSysEffVars = np.asarray(fluxSysEffVars)
-
-    fluxStatSigmas = np.sqrt(fluxStatVars)
-    fluxSysLSigmas = np.sqrt(fluxSysLVars)
-    fluxSysEffSigmas = np.sqrt(fluxSysEffVars)
-
-    fluxSysVars = fluxSysLVars + fluxSysEffVars
-    fluxSysSigmas = np.sqrt(fluxSysVars)
-
-    covMat = np.zeros((N, N))
-    for i in range(N):
-        for j in range(N):
-            cov = 0.0
-            if i == j:
-                cov = fluxStatVars[i] + fluxSysVars[i]
-            else:
-                cov += rhoEff * fluxSysEffSigmas[i] * fluxSysEffSigmas[j]
-                cov += rhoL   * fluxSysLSigmas[i] * fluxSysLSigmas[j]
-            covMat[i, j] = cov
-
-    covMatInv = inv(covMat)
-
-    ones = np.ones(N)
-    meanFlux = (ones @ covMatInv @ fluxes) / (ones @ covMatInv @ ones)
-    fluxVar = 1 / (ones @ covMatInv @ ones)
-
-    chi2 = (fluxes - meanFlux) @ covMatInv @ (fluxes - meanFlux)
-    pVal = 1 - chi2_dist.cdf(chi2, df=N - 1)
-
-    def f(s2):
-        denom = fluxStatVars + fluxSysVars + s2
-        weighted_mean = np.sum(fluxes / denom) / np.sum(1 / denom)
-        return np.sum(((fluxes - weighted_mean)**2) / denom) - (N - 1)
-
-    try:
-        sysMethodVar = brentq(f, 0, 1e10)
-    except ValueError:
-        sysMethodVar = 0.0
-
-    return {
-        "flux": meanFlux,
-        "stat": fluxVar,
-        "sysL": np.max(fluxSysLVars),
-        "sysEff": np.max(fluxSysEffVars),
-        "sysMethod": sysMethodVar
-    }, {
-        "chi2": chi2,
-        "pVal": pVal
-    }
+    return _getFluxWithAllVariances(fluxes, fluxStatVars, fluxSysLVars, fluxSysEffVars, rhoL=rhoL, rhoEff=rhoEff)
@@ -0,0 +1,266 @@
+import numpy as np
+import pandas as pd
+import uproot
+from typing import Union
+from utils.intervals import parseStatOption, getEffIntervals
+
+
+
+def _getHistArrays(hist) -> tuple:
+    if not isinstance(hist, uproot.Model):
+        hist = uproot.from_pyroot(hist)
+    edges = tuple(np.asarray(axis.edges(), dtype=np.float64) for axis in hist.axes)
+    return np.asarray(hist.values(), dtype=np.float64), edges
+
+
+
+class ArrayEff:
+    """
+    Efficiency held as numpy arrays of passed/total counts (indexed [x] or
+    [x, y], without under- and overflow bins) and the bin edges of each axis.
+
+    Slicing returns views of the counts, intervals are computed for all
+    bins in one call (see utils.intervals.getEffIntervals), and ROOT
+    objects are only built on request by ToTEfficiency/ToGraph.
+    """
+
+    def __init__(self,
+        Passed,
+        Total,
+        Edges: Union[tuple, list, np.ndarray],
+        StatOption: str = "Clopper Pearson",
+        CL: float = 0.682689,
+        Name: Union[str, None] = None,
+        Title: Union[str, None] = None
+    ):
+        self.Passed = np.asarray(Passed, dtype=np.float64)
+        self.Total = np.asarray(Total, dtype=np.float64)
+        if isinstance(Edges, np.ndarray) and Edges.ndim == 1:
+            Edges = (Edges,)
+        self.Edges = tuple(np.asarray(e, dtype=np.float64) for e in Edges)
+
+        if self.Passed.shape != self.Total.shape:
+            raise ValueError("Passed and Total arrays must have the same shape!")
+        if self.Passed.ndim not in (1, 2) or len(self.Edges) != self.Passed.ndim:
+            raise ValueError("Efficiencies have to be one or two dimensional, with one edge array per axis!")
+        if any(len(e) != n + 1 for e, n in zip(self.Edges, self.Passed.shape)):
+            raise ValueError("Each axis needs one more bin edge than bins!")
+
+        parseStatOption(StatOption)
+        self.StatOption = StatOption
+        self.CL = CL
+        self.Name = Name
+        self.Title = Title
+        self._teff = None
+
+
+    @classmethod
+    def FromHists(cls,
+        Passed,
+        Total,
+        StatOption: str = "Clopper Pearson",
+        CL: float = 0.682689,
+        Name: Union[str, None] = None,
+        Title: Union[str, None] = None
+    ) -> "ArrayEff":
+        """
+        Build from ROOT or uproot TH1/TH2 passed and total histograms.
+        """
+        passed, edges = _getHistArrays(Passed)
+        total, totalEdges = _getHistArrays(Total)
+        if any(not np.array_equal(a, b) for a, b in zip(edges, totalEdges)):
+            raise ValueError("Passed and Total histograms have different binning!")
+        return cls(passed, total, edges, StatOption, CL, Name, Title)
+
+    @classmethod
+    def FromTEfficiency(cls, teff, StatOption: Union[str, None] = None, CL: Union[float, None] = None) -> "ArrayEff":
+        if not isinstance(teff, uproot.Model):
+            from utils.teff import getStatOption
+            StatOption = StatOption or getStatOption(teff)
+            CL = CL or teff.GetConfidenceLevel()
+            passed, total = teff.GetPassedHistogram(), teff.GetTotalHistogram()
+            name, title = teff.GetName(), teff.GetTitle()
+        else:
+            passed, total = teff.member("fPassedHistogram"), teff.member("fTotalHistogram")
+            name, title = teff.member("fName"), teff.member("fTitle")
+        return cls.FromHists(passed, total, StatOption or "Clopper Pearson", CL or 0.682689, name, title)
+
+
+    def _new(self, passed, total, edges) -> "ArrayEff":
+        return ArrayEff(passed, total, edges, self.StatOption, self.CL, self.Name, self.Title)
+
+    @property
+    def Dim(self) -> int:
+        return self.Passed.ndim
+
+    @property
+    def Shape(self) -> tuple:
+        return self.Passed.shape
+
+    def GetBinCenters(self, axis: int = 0) -> np.ndarray:
+        edges = self.Edges[axis]
+        return 0.5 * (edges[:-1] + edges[1:])
+
+    def GetBinWidths(self, axis: int = 0) -> np.ndarray:
+        return np.diff(self.Edges[axis])
+
+
+    def __getitem__(self, key) -> "ArrayEff":
+        """
+        Select a range of bins per axis; counts are views of this object's arrays.
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > self.Dim:
+            raise IndexError(f"Too many indices for a {self.Dim}D efficiency!")
+        key = key + (slice(None),) * (self.Dim - len(key))
+
+        slices = []
+        for k, n in zip(key, self.Shape):
+            if isinstance(k, (int, np.integer)):
+                k = slice(k, k + 1 if k != -1 else None)
+            if not isinstance(k, slice) or k.step not in (None, 1):
+                raise IndexError("Only contiguous bin ranges (integers or slices without step) are supported!")
+            start, stop, _ = k.indices(n)
+            slices.append(slice(start, max(start, stop)))
+
+        edges = tuple(e[s.start:s.stop + 1] for e, s in zip(self.Edges, slices))
+        return self._new(self.Passed[tuple(slices)], self.Total[tuple(slices)], edges)
+
+
+    def Rebin(self, factors: Union[int, tuple]) -> "ArrayEff":
+        """
+        Merge groups of `factors` adjacent bins (one factor per axis).
+        """
+        if isinstance(factors, (int, np.integer)):
+            factors = (factors,) * self.Dim
+        if len(factors) != self.Dim:
+            raise ValueError("One rebinning factor per axis has to be provided!")
+        if any(n % f for n, f in zip(self.Shape, factors)):
+            raise ValueError(f"Rebinning factors {factors} do not divide the number of bins {self.Shape}!")
+
+        shape = [x for n, f in zip(self.Shape, factors) for x in (n // f, f)]
+        sumAxes = tuple(range(1, 2 * self.Dim, 2))
+        edges = tuple(e[::f] for e, f in zip(self.Edges, factors))
+        return self._new(
+            self.Passed.reshape(shape).sum(axis=sumAxes),
+            self.Total.reshape(shape).sum(axis=sumAxes),
+            edges
+        )
+
+
+    def Project(self, axis: int = 0) -> "ArrayEff":
+        """
+        1D efficiency along `axis`, summing the counts over the other axis.
+        """
+        if self.Dim != 2:
+            raise ValueError("Only two-dimensional efficiencies can be projected!")
+        other = 1 - axis
+        return self._new(self.Passed.sum(axis=other), self.Total.sum(axis=other), (self.Edges[axis],))
+
+
+    def _checkCompatible(self, other: "ArrayEff"):
+        if not isinstance(other, ArrayEff):
+            raise ValueError(f"Cannot add {type(other)} to an ArrayEff!")
+        if self.Shape != other.Shape or any(not np.array_equal(a, b) for a, b in zip(self.Edges, other.Edges)):
+            raise ValueError("Efficiencies have different binning!")
+
+    def __add__(self, other: "ArrayEff") -> "ArrayEff":
+        self._checkCompatible(other)
+        return self._new(self.Passed + other.Passed, self.Total + other.Total, self.Edges)
+
+    def __iadd__(self, other: "ArrayEff") -> "ArrayEff":
+        self._checkCompatible(other)
+        self.Passed = self.Passed + other.Passed
+        self.Total = self.Total + other.Total
+        self._teff = None
+        return self
+
+    def Add(self, other: "ArrayEff") -> "ArrayEff":
+        return self.__iadd__(other)
+
+
+    def GetEffWithErrors(self) -> tuple:
+        """
+        Returns:
+            tuple: (efficiency, upper error, lower error) arrays with the shape of the counts
+        """
+        return getEffIntervals(self.Passed, self.Total, statOption=self.StatOption, cl=self.CL)
+
+    def GetEfficiency(self) -> np.ndarray:
+        return self.GetEffWithErrors()[0]
+
+
+    def ToPandas(self) -> pd.DataFrame:
+        if self.Dim != 1:
+            raise ValueError("Only one-dimensional efficiencies can be converted to a DataFrame!")
+        y, eyh, eyl = self.GetEffWithErrors()
+        ex = self.GetBinWidths() / 2
+        return pd.DataFrame({
+            'x': self.GetBinCenters(), 'y': y, 'exl': ex, 'exh': ex, 'eyl': eyl, 'eyh': eyh
+        })
+
+
+    def _getHist(self, counts: np.ndarray, name: str):
+        import ROOT
+
+        title = self.Title or ""
+        if self.Dim == 1:
+            hist = ROOT.TH1D(name, title, len(self.Edges[0]) - 1, self.Edges[0])
+            content = np.zeros(counts.shape[0] + 2)
+            content[1:-1] = counts
+        else:
+            hist = ROOT.TH2D(name, title, len(self.Edges[0]) - 1, self.Edges[0], len(self.Edges[1]) - 1, self.Edges[1])
+            # ROOT's global bin is ix + (nx + 2) * iy
+            content = np.zeros((counts.shape[1] + 2, counts.shape[0] + 2))
+            content[1:-1, 1:-1] = counts.T
+        hist.SetDirectory(ROOT.nullptr)
+        hist.SetContent(np.ascontiguousarray(content.ravel()))
+        hist.SetEntries(counts.sum())
+        return hist
+
+    def ToTEfficiency(self):
+        """
+        The equivalent ROOT.TEfficiency, built on first use.
+        """
+        if self._teff is None:
+            from utils.teff import getTEff
+            name = self.Name or "eff"
+            self._teff = getTEff(
+                self._getHist(self.Passed, f"{name}_passed"),
+                self._getHist(self.Total, f"{name}_total"),
+                statOption = self.StatOption,
+                cl = self.CL,
+                name = name,
+                title = self.Title or ""
+            )
+        return self._teff
+
+    def ToGraph(self):
+        """
+        TGraphAsymmErrors (1D) or TGraph2D (2D) of the efficiency, filled
+        directly from the arrays.
+        """
+        import ROOT
+
+        name = self.Name or "eff"
+        y, eyh, eyl = self.GetEffWithErrors()
+        if self.Dim == 1:
+            ex = self.GetBinWidths() / 2
+            graph = ROOT.TGraphAsymmErrors(len(y), self.GetBinCenters(), y.astype(np.float64), ex, ex, eyl, eyh)
+        else:
+            x, yy = np.meshgrid(self.GetBinCenters(0), self.GetBinCenters(1), indexing="ij")
+            graph = ROOT.TGraph2D(y.size, x.ravel(), yy.ravel(), np.ascontiguousarray(y.ravel()))
+
+        graph.SetName(name if name.startswith("gr_") else f"gr_{name}")
+        graph.SetTitle(self.Title or "")
+        return graph
+
+
+    def Print(self):
+        print("DDF Array Efficiency:")
+        if self.Name:  print(f" > Name:             {self.Name}")
+        if self.Title: print(f" > Title:            {self.Title}")
+        print(f" > Bins:             {' x '.join(str(n) for n in self.Shape)}")
+        print(f" > Confidence Level: {self.CL}")
+        print(f" > Stat Option:      {self.StatOption}")
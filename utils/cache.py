@@ -0,0 +1,99 @@
+import os
+import threading
+from typing import Callable
+from collections import OrderedDict
+
+
+def getCacheDir() -> str:
+    """
+    Return the directory used for on-disk caches, creating it if needed.
+
+    The location can be overridden with the `DDF_CACHE_DIR` environment
+    variable and defaults to `~/.cache/ddf`.
+
+    Returns:
+        str: Path to the cache directory
+    """
+    cacheDir = os.environ.get("DDF_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ddf"))
+    os.makedirs(cacheDir, exist_ok=True)
+    return cacheDir
+
+
+def writeAtomically(path: str, write: Callable, binary: bool = False):
+    """
+    Write a file through a temporary file renamed over `path`, so readers
+    (also in other processes) never see a partially written file.
+
+    Args:
+        path: Destination file
+        write: Called with the open temporary file
+        binary: Open the temporary file in binary mode
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmpPath = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmpPath, "wb" if binary else "w") as f:
+            write(f)
+        os.replace(tmpPath, path)
+    except BaseException:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+        raise
+
+
+class LruCache:
+    """
+    Thread-safe in-memory LRU of at most `MaxSize` entries.
+
+    The lock is only held while the cache is accessed, values are computed
+    outside of it (two threads may compute the same missing value).
+    """
+
+    def __init__(self, MaxSize: int):
+        self.MaxSize = int(MaxSize)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def Get(self, key, default=None):
+        return self.GetMany([key], default)[0]
+
+    def GetMany(self, keys: list, default=None) -> list:
+        with self._lock:
+            values = []
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    values.append(self._entries[key])
+                else:
+                    values.append(default)
+            return values
+
+    def Put(self, key, value):
+        self.PutMany([(key, value)])
+
+    def PutMany(self, items):
+        with self._lock:
+            for key, value in items:
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.MaxSize:
+                self._entries.popitem(last=False)
+
+    def GetOrCreate(self, key, factory: Callable):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        value = factory()
+        self.Put(key, value)
+        return value
+
+    def Clear(self):
+        with self._lock:
+            self._entries.clear()
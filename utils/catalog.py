@@ -0,0 +1,406 @@
+import os, re, json, glob
+import threading
+import uproot
+from typing import Union
+from concurrent.futures import ThreadPoolExecutor
+from utils.cache import getCacheDir, writeAtomically
+
+
+PHYSICS_DIR = "/eos/experiment/sndlhc/convertedData/physics"
+
+
+class RunCatalog:
+    """
+    On-disk index of the converted physics runs.
+
+    Every run is stored with its year, directory, file list, fill, first
+    timestamp and entry count. Directory listings are only repeated for the
+    year/group directories whose mtime changed since the last refresh, so a
+    lookup of a known run is a dictionary hit.
+    """
+
+    def __init__(self,
+        RootDir: str = PHYSICS_DIR,
+        CacheFile: Union[str, None] = None
+    ):
+        self.RootDir = RootDir
+        if CacheFile is None:
+            CacheFile = os.path.join(getCacheDir(), "runCatalog.json")
+        self.CacheFile = CacheFile
+
+        self.Runs = {}
+        self.Mtimes = {}
+        self._lock = threading.RLock()
+        self.Load()
+
+
+    def Load(self):
+        if not os.path.exists(self.CacheFile):
+            return
+
+        try:
+            with open(self.CacheFile, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if data.get("RootDir") != self.RootDir:
+            return
+
+        self.Runs = {int(run): entry for run, entry in data.get("Runs", {}).items()}
+        self.Mtimes = data.get("Mtimes", {})
+
+    def Save(self):
+        with self._lock:
+            data = {
+                "RootDir": self.RootDir,
+                "Mtimes": self.Mtimes,
+                "Runs": {str(run): entry for run, entry in self.Runs.items()}
+            }
+            writeAtomically(self.CacheFile, lambda f: json.dump(data, f))
+
+
+    def _listRunDirs(self, path: str) -> dict:
+        runDirs = {}
+        with os.scandir(path) as it:
+            for d in it:
+                m = re.fullmatch(r'run_(\d+)', d.name)
+                if m and d.is_dir():
+                    runDirs[int(m.group(1))] = d.path
+        return runDirs
+
+    def _scanDir(self, path: str, year: int, grouped: bool, force: bool) -> bool:
+        mtime = os.stat(path).st_mtime
+        if not force and self.Mtimes.get(path) == mtime:
+            if not grouped:
+                return False
+
+            changed = False
+            for group in [p for p in self.Mtimes if os.path.dirname(p) == path]:
+                if os.path.isdir(group):
+                    changed |= self._scanDir(group, year, False, force)
+            return changed
+
+        runDirs = self._listRunDirs(path)
+        if grouped:
+            for group in runDirs.values():
+                self._scanDir(group, year, False, force)
+        else:
+            for run in [r for r, e in self.Runs.items() if os.path.dirname(e["directory"]) == path]:
+                if run not in runDirs:
+                    del self.Runs[run]
+
+            for run, runDir in runDirs.items():
+                entry = self.Runs.get(run)
+                if entry is None or entry["directory"] != runDir:
+                    self.Runs[run] = {
+                        "year": year,
+                        "directory": runDir,
+                        "files": None,
+                        "fill": None,
+                        "timestamp": None,
+                        "entries": None
+                    }
+
+        self.Mtimes[path] = mtime
+        return True
+
+    def Refresh(self, years: Union[list, None] = None, force: bool = False):
+        """
+        Rescan the year (and, from 2024 on, run group) directories whose
+        mtime changed since the previous refresh.
+
+        Args:
+            years: Years to refresh (default: all years found under RootDir)
+            force: Rescan every directory regardless of its mtime
+        """
+        with self._lock:
+            if years is None:
+                years = [int(d) for d in os.listdir(self.RootDir) if re.fullmatch(r'\d{4}', d)]
+
+            changed = False
+            for year in years:
+                path = f"{self.RootDir}/{year}"
+                if os.path.isdir(path):
+                    changed |= self._scanDir(path, year, year >= 2024, force)
+
+            if changed:
+                self.Save()
+
+
+    def _getEntry(self, run: int) -> dict:
+        run = int(run)
+        entry = self.Runs.get(run)
+        if entry is None:
+            self.Refresh()
+            entry = self.Runs.get(run)
+        if entry is None:
+            raise ValueError(f"Run {run} was not found!")
+        return entry
+
+    def GetRuns(self, year: int) -> list:
+        # Cheap when nothing changed: only the year/group directories are stat'ed
+        self.Refresh(years=[year])
+        return sorted(run for run, e in self.Runs.items() if e["year"] == year)
+
+    def GetYear(self, run: int) -> int:
+        return self._getEntry(run)["year"]
+
+    def GetDirectory(self, run: int) -> str:
+        return self._getEntry(run)["directory"]
+
+    def GetFiles(self, run: int, refresh: bool = True) -> list:
+        """
+        Return the raw data files of a run. The listing is repeated if the
+        run directory mtime changed since it was stored (unless `refresh`
+        is False), which also drops the cached entry count.
+        """
+        entry = self._getEntry(run)
+        if entry["files"] is None or refresh:
+            mtime = os.stat(entry["directory"]).st_mtime
+            if entry["files"] is None or entry.get("mtime") != mtime:
+                files = sorted(glob.glob(os.path.join(entry["directory"], "sndsw_raw-*.root")))
+                if files != entry["files"]:
+                    self.Update(run, files=files, mtime=mtime, entries=None)
+                else:
+                    self.Update(run, mtime=mtime)
+        return list(entry["files"])
+
+    def Get(self, run: int, field: str):
+        return self._getEntry(run).get(field)
+
+    def Update(self, run: int, save: bool = True, **fields):
+        """
+        Store metadata discovered for a run (e.g. fill, timestamp, entries).
+        """
+        with self._lock:
+            entry = self._getEntry(run)
+            entry.update(fields)
+            if save:
+                self.Save()
+
+
+
+class EntryCache:
+    """
+    On-disk cache of per-file tree entry counts, keyed by path, size and mtime.
+    """
+
+    def __init__(self, CacheFile: Union[str, None] = None):
+        if CacheFile is None:
+            CacheFile = os.path.join(getCacheDir(), "entryCache.json")
+        self.CacheFile = CacheFile
+        self.Entries = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(self.CacheFile):
+            try:
+                with open(self.CacheFile, "r") as f:
+                    self.Entries = json.load(f)
+            except (OSError, ValueError):
+                self.Entries = {}
+
+    def Save(self):
+        with self._lock:
+            writeAtomically(self.CacheFile, lambda f: json.dump(self.Entries, f))
+
+    def Get(self, file_: str, treeName: str, stat: os.stat_result) -> Union[int, None]:
+        entry = self.Entries.get(file_)
+        if (
+            entry is not None and
+            entry["tree"] == treeName and
+            entry["size"] == stat.st_size and
+            entry["mtime"] == stat.st_mtime
+        ):
+            return entry["entries"]
+        return None
+
+    def Set(self, file_: str, treeName: str, stat: os.stat_result, entries: int):
+        with self._lock:
+            self.Entries[file_] = {"tree": treeName, "size": stat.st_size, "mtime": stat.st_mtime, "entries": entries}
+
+
+
+def getTreeName(file_: str) -> Union[str, None]:
+    with uproot.open(file_) as f:
+        for treeName in ("cbmsim", "rawConv"):
+            if treeName in f:
+                return treeName
+    return None
+
+
+def getFileEntries(
+    files: Union[dict, list],
+    treeName: Union[str, None] = None,
+    nThreads: int = 16
+) -> dict:
+    """
+    Number of tree entries in each file, read from the file metadata with
+    uproot in a thread pool. Counts are cached on disk and only re-read
+    when a file's size or mtime changes.
+
+    Args:
+        files: List of files (with `treeName`) or a dict mapping file -> tree name
+        treeName: Tree name used when `files` is a list (default: detected from the first file)
+        nThreads: Number of threads
+
+    Returns:
+        dict: Mapping file -> number of entries
+    """
+    if not isinstance(files, dict):
+        files = list(files)
+        if files and treeName is None:
+            treeName = getTreeName(files[0])
+        files = {file_: treeName for file_ in files}
+
+    cache = getEntryCache()
+
+    def getEntries(item):
+        file_, treeName_ = item
+        if treeName_ is None:
+            return 0
+
+        stat = os.stat(file_)
+        entries = cache.Get(file_, treeName_, stat)
+        if entries is None:
+            with uproot.open(file_) as f:
+                entries = int(f[treeName_].num_entries) if treeName_ in f else 0
+            cache.Set(file_, treeName_, stat, entries)
+        return entries
+
+    with ThreadPoolExecutor(max_workers=nThreads) as executor:
+        entries = dict(zip(files, executor.map(getEntries, files.items())))
+
+    cache.Save()
+    return entries
+
+
+
+_entryCache = None
+
+def getEntryCache() -> EntryCache:
+    global _entryCache
+    if _entryCache is None:
+        _entryCache = EntryCache()
+    return _entryCache
+
+
+
+SND_RUNS_JSON = "/eos/user/i/idioniso/1_Data/sndRuns.json"
+
+
+class FillMap:
+    """
+    Bidirectional run <-> fill map, loaded once per process.
+
+    Combines the shared run -> fill JSON with a local cache of fills that
+    were discovered from the raw data, and keeps a reverse fill -> runs index.
+    """
+
+    def __init__(self,
+        JsonFile: str = SND_RUNS_JSON,
+        CacheFile: Union[str, None] = None
+    ):
+        self.JsonFile = JsonFile
+        if CacheFile is None:
+            CacheFile = os.path.join(getCacheDir(), "fills.json")
+        self.CacheFile = CacheFile
+
+        self.Fills = {}
+        self.Runs = {}
+        self.Discovered = {}
+        self._lock = threading.RLock()
+        self.Load()
+
+    def Load(self):
+        for path in (self.JsonFile, self.CacheFile):
+            if not os.path.exists(path):
+                continue
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+
+            for run, fill in data.items():
+                if fill is not None:
+                    self._add(int(run), int(fill))
+            if path == self.CacheFile:
+                self.Discovered.update({int(run): int(fill) for run, fill in data.items() if fill is not None})
+
+    def Save(self):
+        with self._lock:
+            data = {str(run): fill for run, fill in self.Discovered.items()}
+            writeAtomically(self.CacheFile, lambda f: json.dump(data, f))
+
+    def _add(self, run: int, fill: int):
+        oldFill = self.Fills.get(run)
+        if oldFill is not None and oldFill != fill:
+            self.Runs[oldFill].discard(run)
+        self.Fills[run] = fill
+        self.Runs.setdefault(fill, set()).add(run)
+
+    def Add(self, run: int, fill: int, save: bool = True):
+        """
+        Record a fill discovered for a run and write it to the local cache.
+        """
+        with self._lock:
+            self._add(int(run), int(fill))
+            self.Discovered[int(run)] = int(fill)
+            if save:
+                self.Save()
+
+    def GetFill(self, run: int) -> Union[int, None]:
+        return self.Fills.get(int(run))
+
+    def GetRuns(self, fill: int) -> list:
+        return sorted(self.Runs.get(int(fill), ()))
+
+    def Resolve(self, runs: list, fallback, nThreads: int = 8) -> dict:
+        """
+        Fills of many runs. Runs missing from the map are resolved with
+        `fallback(run)` in a thread pool and added to the map.
+
+        Returns:
+            dict: Mapping run -> fill (None if the fallback failed)
+        """
+        runs = [int(run) for run in runs]
+        missing = sorted(set(run for run in runs if run not in self.Fills))
+
+        if missing:
+            def tryFallback(run):
+                try:
+                    return fallback(run)
+                except Exception as e:
+                    print(f"Fill number not found for run {run}: {e}")
+                    return None
+
+            with ThreadPoolExecutor(max_workers=nThreads) as executor:
+                found = dict(zip(missing, executor.map(tryFallback, missing)))
+
+            with self._lock:
+                for run, fill in found.items():
+                    if fill is not None:
+                        self.Add(run, fill, save=False)
+                self.Save()
+
+        return {run: self.Fills.get(run) for run in runs}
+
+
+
+_fillMaps = {}
+
+def getFillMap(jsonFile: str = SND_RUNS_JSON) -> FillMap:
+    if jsonFile not in _fillMaps:
+        _fillMaps[jsonFile] = FillMap(jsonFile)
+    return _fillMaps[jsonFile]
+
+
+
+_runCatalog = None
+
+def getRunCatalog() -> RunCatalog:
+    global _runCatalog
+    if _runCatalog is None:
+        _runCatalog = RunCatalog()
+    return _runCatalog
@@ -0,0 +1,146 @@
+import re
+import numpy as np
+import uproot
+import awkward as ak
+from typing import Union, Iterable
+from utils.catalog import getFileEntries
+
+
+# Branch groups of the cbmsim/rawConv trees: collection prefix and the
+# members read for it. Member names are resolved against the tree keys, so
+# split (EventHeader./EventHeader.fEventTime) and flat layouts both work.
+BRANCH_GROUPS = {
+    "header": ("EventHeader", {
+        "eventTime":   "fEventTime",
+        "timestamp":   "fUTCtimestamp",
+        "eventNumber": "fEventNumber",
+        "runId":       "fRunId",
+        "fill":        "fFillNumber",
+        "flags":       "fFlags"
+    }),
+    "scifiHits":     ("Digi_ScifiHits",    {"detID": "fDetectorID"}),
+    "mufiHits":      ("Digi_MuFilterHits", {"detID": "fDetectorID"}),
+    "scifiClusters": ("Cluster_Scifi",     {"first": "fFirst", "n": "fN"}),
+    "mufiClusters":  ("Cluster_Mufi",      {"first": "fFirst", "n": "fN"}),
+    "tracks":        ("Reco_MuonTracks",   {"type": "fTrackType", "flag": "fFlag", "chi2": "fChi2", "ndf": "fNdf"}),
+    "mcTracks":      ("MCTrack",           {"pdg": "fPdgCode", "motherID": "fMotherId", "w": "fW"}),
+    "scifiPoints":   ("ScifiPoint",        {"detID": "fDetectorID", "trackID": "fTrackID", "pdg": "fPdgCode"}),
+    "mufiPoints":    ("MuFilterPoint",     {"detID": "fDetectorID", "trackID": "fTrackID", "pdg": "fPdgCode"})
+}
+
+
+
+def getBranchMap(tree, groups: Iterable[str] = ("header",)) -> dict:
+    """
+    Resolve the members of the requested branch groups to the keys of an
+    uproot tree.
+
+    Returns:
+        dict: Mapping '{group}.{alias}' -> tree key, for every member found in the tree
+    """
+    keys = tree.keys(recursive=True)
+
+    branchMap = {}
+    for group in groups:
+        if group not in BRANCH_GROUPS:
+            raise ValueError(f"Invalid branch group '{group}'! Allowed groups are: {', '.join(BRANCH_GROUPS)}")
+
+        prefix, members = BRANCH_GROUPS[group]
+        for alias, member in members.items():
+            pattern = re.compile(rf"(^|/){prefix}\.?{member}$")
+            matches = [key for key in keys if pattern.search(key)]
+            if matches:
+                branchMap[f"{group}.{alias}"] = min(matches, key=len)
+
+    return branchMap
+
+
+def iterateEvents(
+    files: Union[dict, list],
+    treeName: Union[str, None] = None,
+    groups: Iterable[str] = ("header",),
+    stepSize: Union[int, str] = "100 MB",
+    entryStart: Union[int, None] = None,
+    entryStop: Union[int, None] = None
+):
+    """
+    Iterate over events in fixed-size chunks of columnar arrays.
+
+    Args:
+        files: List of files (with `treeName`) or a dict mapping file -> tree name
+        treeName: Tree name used when `files` is a list
+        groups: Branch groups to read (see BRANCH_GROUPS)
+        stepSize: Number of entries or memory size per chunk
+        entryStart: First global entry to read
+        entryStop: Global entry to stop before
+
+    Yields:
+        dict: Mapping '{group}.{alias}' -> awkward array for the chunk
+    """
+    if not isinstance(files, dict):
+        if treeName is None:
+            raise ValueError("A tree name has to be provided together with a list of files!")
+        files = {file_: treeName for file_ in files}
+    if not files:
+        return
+
+    firstFile, firstTree = next(iter(files.items()))
+    with uproot.open(firstFile) as f:
+        branchMap = getBranchMap(f[firstTree], groups)
+
+    aliases = {key: alias for alias, key in branchMap.items()}
+    filterName = list(branchMap.values())
+
+    if entryStart is None and entryStop is None:
+        for chunk in uproot.iterate(files, filter_name=filterName, step_size=stepSize, library="ak", how=dict):
+            yield {aliases[key]: array for key, array in chunk.items() if key in aliases}
+        return
+
+    # uproot.iterate has no entry range, so map the global range onto each file
+    entries = getFileEntries(files)
+    offset = 0
+    for file_, treeName_ in files.items():
+        if entryStop is not None and offset >= entryStop:
+            break
+        nEntries = entries[file_]
+        start = max((entryStart or 0) - offset, 0)
+        stop = nEntries if entryStop is None else min(entryStop - offset, nEntries)
+        offset += nEntries
+        if start >= stop:
+            continue
+
+        with uproot.open(file_) as f:
+            for chunk in f[treeName_].iterate(
+                filter_name=filterName,
+                step_size=stepSize,
+                entry_start=start,
+                entry_stop=stop,
+                library="ak",
+                how=dict
+            ):
+                yield {aliases[key]: array for key, array in chunk.items() if key in aliases}
+
+
+
+def countHits(chunk: dict, tt: int) -> np.ndarray:
+    """
+    Vectorized getN: number of clusters/hits used by track type `tt` per event.
+    """
+    if tt == 1:
+        return ak.to_numpy(ak.num(chunk["scifiClusters.first"], axis=1))
+    elif tt == 11:
+        return ak.to_numpy(ak.num(chunk["scifiHits.detID"], axis=1))
+    elif tt == 3:
+        return ak.to_numpy(ak.num(chunk["mufiClusters.first"], axis=1))
+    elif tt == 13:
+        return ak.to_numpy(ak.sum(chunk["mufiHits.detID"] // 10000 == 3, axis=1))
+    else:
+        raise ValueError(f"Invalid track type: {tt}.")
+
+
+def countTracks(chunk: dict, tts: Iterable[int] = (1, 11, 3, 13)) -> dict:
+    """
+    Number of reconstructed tracks of each track type per event.
+    """
+    trackTypes = chunk["tracks.type"]
+    return {tt: ak.to_numpy(ak.sum(trackTypes == tt, axis=1)) for tt in tts}
@@ -0,0 +1,339 @@
+import os
+import json
+import threading
+import numpy as np
+import pandas as pd
+from typing import Union
+from scipy.linalg import cho_factor, cho_solve
+from scipy.optimize import brentq
+from scipy.stats import chi2 as chi2_dist
+from utils.cache import writeAtomically
+
+
+def getFluxArrays(
+    N,
+    eff,
+    L,
+    effErr,
+    dL: Union[float, np.ndarray] = 0.035,
+    k: Union[int, np.ndarray] = 1,
+    A: float = 928,
+    asPandas: bool = False,
+    index = None,
+    tts: tuple = (1, 11, 3, 13),
+    suffix: str = ""
+):
+    """
+    Array version of getFluxWithErrAndRelativeVariances.
+
+    All inputs are broadcast against each other, e.g. N of shape
+    (nRuns, nTrackTypes) with L and k of shape (nRuns, 1) and eff/effErr of
+    shape (nRuns, nTrackTypes) or (nTrackTypes,).
+
+    Args:
+        N: Number of tracks
+        eff: Efficiency
+        L: Integrated luminosity
+        effErr: Efficiency error
+        dL: Relative luminosity error (fraction from 0 to 1)
+        k: Scale factor
+        A: Area
+        asPandas: Return a DataFrame with one row per run (requires 2D arrays with one column per track type)
+        index: Index of the DataFrame (e.g. run numbers)
+        tts: Track types of the columns
+        suffix: Suffix of the DataFrame column names (e.g. '_eos')
+
+    Returns:
+        tuple: (flux, errPhi, errPhi_2, errN_2, errEff_2, errL_2) arrays, or a DataFrame if asPandas
+    """
+    N, eff, L, effErr, dL, k = (np.asarray(x, dtype=np.float64) for x in (N, eff, L, effErr, dL, k))
+    if np.any((dL < 0) | (dL > 1)):
+        raise ValueError("Luminosity error 'dL' have to be given as a fraction (from 0 to 1) of the total luminosity!")
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        flux = (N*k)/(A*L*eff)
+
+        errN_2   = (k**2 * N)                / (A**2 * L**2 * eff**2)
+        errEff_2 = (k**2 * N**2 * effErr**2) / (A**2 * L**2 * eff**4)
+        errL_2   = (N**2 * k**2 * (dL*L)**2) / (A**2 * L**4 * eff**2)
+
+    errPhi_2 = errN_2 + errEff_2 + errL_2
+    errPhi = np.sqrt(errPhi_2)
+
+    if not asPandas:
+        return flux, errPhi, errPhi_2, errN_2, errEff_2, errL_2
+
+    if flux.ndim != 2 or flux.shape[1] != len(tts):
+        raise ValueError("Pandas output requires arrays of shape (nRuns, nTrackTypes)!")
+
+    columns = {}
+    for i, tt in enumerate(tts):
+        columns[f"Flux{tt}{suffix}"] = flux[:, i]
+        columns[f"FluxErr{tt}{suffix}"] = errPhi[:, i]
+        columns[f"FluxVarN{tt}{suffix}"] = errN_2[:, i]
+        columns[f"FluxVarEff{tt}{suffix}"] = errEff_2[:, i]
+        columns[f"FluxVarL{tt}{suffix}"] = errL_2[:, i]
+    return pd.DataFrame(columns, index=index)
+
+
+
+def getFluxCovariance(
+    fluxStatVars,
+    fluxSysLVars,
+    fluxSysEffVars,
+    rhoL: float = 0,
+    rhoEff: float = 0.8
+) -> np.ndarray:
+    """
+    Covariance matrix of the per-run fluxes: statistical and systematic
+    variances on the diagonal, luminosity and efficiency systematics
+    correlated between runs with coefficients `rhoL` and `rhoEff`.
+    """
+    fluxStatVars, fluxSysLVars, fluxSysEffVars = (
+        np.asarray(x, dtype=np.float64) for x in (fluxStatVars, fluxSysLVars, fluxSysEffVars)
+    )
+    sigmaL = np.sqrt(fluxSysLVars)
+    sigmaEff = np.sqrt(fluxSysEffVars)
+
+    covMat = rhoL * np.outer(sigmaL, sigmaL) + rhoEff * np.outer(sigmaEff, sigmaEff)
+    np.fill_diagonal(covMat, fluxStatVars + fluxSysLVars + fluxSysEffVars)
+    return covMat
+
+
+def _getGlsResult(fluxes, covInvOnes, covInvFluxes, covDiag) -> dict:
+    norm = covInvOnes.sum()
+    meanFlux = covInvFluxes.sum() / norm
+    fluxVar = 1 / norm
+
+    residuals = fluxes - meanFlux
+    chi2 = residuals @ (covInvFluxes - meanFlux * covInvOnes)
+    ndf = len(fluxes) - 1
+    pVal = chi2_dist.sf(chi2, df=ndf) if ndf > 0 else np.nan
+
+    # Covariance of the residuals is V - 11^T/(1^T V^-1 1)
+    residualVars = np.maximum(covDiag - fluxVar, 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pulls = residuals / np.sqrt(residualVars)
+
+    return {
+        "flux": meanFlux,
+        "var": fluxVar,
+        "chi2": chi2,
+        "ndf": ndf,
+        "pVal": pVal,
+        "weights": covInvOnes / norm,
+        "pulls": pulls
+    }
+
+
+def combineFluxes(fluxes, covMat) -> dict:
+    """
+    Generalized least-squares mean of correlated fluxes, using a single
+    Cholesky factorization of the covariance matrix.
+
+    Args:
+        fluxes: Per-run fluxes
+        covMat: Covariance matrix of the fluxes (see getFluxCovariance)
+
+    Returns:
+        dict: 'flux' (combined flux), 'var' (its variance), 'chi2', 'ndf',
+              'pVal', 'weights' (GLS weights, summing to 1) and 'pulls'
+              (residuals divided by their standard deviation)
+    """
+    fluxes = np.asarray(fluxes, dtype=np.float64)
+    covMat = np.asarray(covMat, dtype=np.float64)
+
+    factor = cho_factor(covMat, lower=True, check_finite=False)
+    solved = cho_solve(factor, np.column_stack((np.ones(len(fluxes)), fluxes)), check_finite=False)
+    return _getGlsResult(fluxes, solved[:, 0], solved[:, 1], np.diag(covMat))
+
+
+def combineFluxesLowRank(fluxes, diagVars, factors) -> dict:
+    """
+    Same as combineFluxes for a covariance of the form diag(diagVars) + U U^T,
+    with U of shape (nRuns, k) holding the fully correlated components
+    (e.g. sqrt(rho)*sigma per systematic). Uses the Woodbury identity, so
+    only a (k x k) matrix is factorized and the cost is linear in nRuns.
+    """
+    fluxes = np.asarray(fluxes, dtype=np.float64)
+    diagVars = np.asarray(diagVars, dtype=np.float64)
+    U = np.asarray(factors, dtype=np.float64).reshape(len(fluxes), -1)
+    if np.any(diagVars <= 0):
+        raise ValueError("The uncorrelated flux variances have to be positive!")
+
+    rhs = np.column_stack((np.ones(len(fluxes)), fluxes)) / diagVars[:, None]
+    DinvU = U / diagVars[:, None]
+    capacitance = np.eye(U.shape[1]) + U.T @ DinvU
+
+    factor = cho_factor(capacitance, lower=True, check_finite=False)
+    solved = rhs - DinvU @ cho_solve(factor, U.T @ rhs, check_finite=False)
+    return _getGlsResult(fluxes, solved[:, 0], solved[:, 1], diagVars + np.sum(U**2, axis=1))
+
+
+def getCombinedFlux(
+    fluxes, fluxStatVars, fluxSysLVars, fluxSysEffVars, rhoL: float = 0, rhoEff: float = 0.8
+) -> dict:
+    """
+    Combine per-run fluxes with correlated luminosity and efficiency
+    systematics, see combineFluxes for the returned values.
+    """
+    fluxStatVars, fluxSysLVars, fluxSysEffVars = (
+        np.asarray(x, dtype=np.float64) for x in (fluxStatVars, fluxSysLVars, fluxSysEffVars)
+    )
+
+    if 0 <= rhoL <= 1 and 0 <= rhoEff <= 1:
+        return combineFluxesLowRank(
+            fluxes,
+            fluxStatVars + (1 - rhoL) * fluxSysLVars + (1 - rhoEff) * fluxSysEffVars,
+            np.column_stack((np.sqrt(rhoL * fluxSysLVars), np.sqrt(rhoEff * fluxSysEffVars)))
+        )
+
+    covMat = getFluxCovariance(fluxStatVars, fluxSysLVars, fluxSysEffVars, rhoL, rhoEff)
+    return combineFluxes(fluxes, covMat)
+
+
+def getFluxWithAllVariances(
+    fluxes, fluxStatVars, fluxSysLVars, fluxSysEffVars, rhoL: float = 0, rhoEff: float = 0.8
+):
+    fluxes = np.asarray(fluxes, dtype=np.float64)
+    N = len(fluxes)
+
+    fluxStatVars, fluxSysLVars, fluxSysEffVars = (
+        np.asarray(x, dtype=np.float64) for x in (fluxStatVars, fluxSysLVars, fluxSysEffVars)
+    )
+    fluxSysVars = fluxSysLVars + fluxSysEffVars
+
+    combined = getCombinedFlux(fluxes, fluxStatVars, fluxSysLVars, fluxSysEffVars, rhoL, rhoEff)
+
+    def f(s2):
+        denom = fluxStatVars + fluxSysVars + s2
+        weighted_mean = np.sum(fluxes / denom) / np.sum(1 / denom)
+        return np.sum(((fluxes - weighted_mean)**2) / denom) - (N - 1)
+
+    try:
+        sysMethodVar = brentq(f, 0, 1e10)
+    except ValueError:
+        sysMethodVar = 0.0
+
+    return {
+        "flux": combined["flux"],
+        "stat": combined["var"],
+        "sysL": np.max(fluxSysLVars),
+        "sysEff": np.max(fluxSysEffVars),
+        "sysMethod": sysMethodVar
+    }, {
+        "chi2": combined["chi2"],
+        "pVal": combined["pVal"],
+        "pulls": combined["pulls"]
+    }
+
+
+
+class FluxAccumulator:
+    """
+    Running weighted mean of the per-run fluxes for each (track type,
+    lumi source), updated in O(1) per run.
+
+    Keeps the sums of the weights 1/err^2 and of the weighted fluxes,
+    together with Welford's unweighted mean and sum of squared deviations,
+    so GetMean reproduces sndUtils.getMeanFlux without touching the runs
+    again. The per-run values are kept as well, so runs can be removed or
+    replaced.
+    """
+
+    def __init__(self, File: Union[str, None] = None):
+        self.File = File
+        self.Runs = {}
+        self.Sums = {}
+        self._lock = threading.RLock()
+        if File is not None and os.path.exists(File):
+            self.Load()
+
+    @staticmethod
+    def _key(tt: int, lumi: str) -> str:
+        return f"{tt}_{lumi}"
+
+    def _update(self, key: str, flux: float, err: float, sign: int):
+        sums = self.Sums.setdefault(key, {"sumW": 0.0, "sumWX": 0.0, "n": 0, "mean": 0.0, "m2": 0.0})
+        w = 1 / err**2
+        sums["sumW"]  += sign * w
+        sums["sumWX"] += sign * w * flux
+
+        n = sums["n"] + sign
+        if n == 0:
+            sums.update(sumW=0.0, sumWX=0.0, n=0, mean=0.0, m2=0.0)
+            return
+        delta = flux - sums["mean"]
+        mean = sums["mean"] + sign * delta / n
+        sums["m2"] = max(sums["m2"] + sign * delta * (flux - mean), 0.0)
+        sums["n"], sums["mean"] = n, mean
+
+    def Add(self, run: int, flux: float, err: float, tt: int, lumi: str = "eos"):
+        """
+        Add the flux of a run, replacing a previous value of the same run.
+        Runs with a non-finite flux or error are skipped.
+        """
+        run, flux, err = int(run), float(flux), float(err)
+        key = self._key(tt, lumi)
+        with self._lock:
+            self.Remove(run, tt, lumi)
+            if not (np.isfinite(flux) and np.isfinite(err) and err > 0):
+                return
+            self.Runs.setdefault(key, {})[run] = (flux, err)
+            self._update(key, flux, err, +1)
+
+    def AddDataFrame(self, df, tts: tuple = (1, 11, 3, 13), lumis: tuple = ("eos",)):
+        """
+        Add all runs of a DataFrame with Run, Flux{tt}_{lumi} and FluxErr{tt}_{lumi} columns.
+        """
+        for tt in tts:
+            for lumi in lumis:
+                for run, flux, err in zip(df["Run"], df[f"Flux{tt}_{lumi}"], df[f"FluxErr{tt}_{lumi}"]):
+                    self.Add(run, flux, err, tt, lumi)
+
+    def Remove(self, run: int, tt: Union[int, None] = None, lumi: Union[str, None] = None):
+        """
+        Remove a run, from all track types and lumi sources unless given.
+        """
+        run = int(run)
+        with self._lock:
+            for key, runs in self.Runs.items():
+                keyTt, keyLumi = key.split("_", 1)
+                if (tt is not None and keyTt != str(tt)) or (lumi is not None and keyLumi != lumi):
+                    continue
+                if run in runs:
+                    flux, err = runs.pop(run)
+                    self._update(key, flux, err, -1)
+
+    def GetMean(self, tt: int, lumi: str = "eos") -> tuple:
+        """
+        Weighted mean flux and its uncertainty, see sndUtils.getMeanFlux.
+        """
+        sums = self.Sums.get(self._key(tt, lumi))
+        if not sums or sums["n"] == 0:
+            return np.nan, np.nan
+
+        weighted_avg = sums["sumWX"] / sums["sumW"]
+        weighted_avg_uncertainty = np.sqrt(1 / sums["sumW"])
+        return weighted_avg, np.sqrt(sums["m2"] / sums["n"]) + weighted_avg_uncertainty
+
+    def GetRuns(self, tt: int, lumi: str = "eos") -> list:
+        return sorted(self.Runs.get(self._key(tt, lumi), {}))
+
+    def Load(self, File: Union[str, None] = None):
+        with open(File or self.File, "r") as f:
+            data = json.load(f)
+        with self._lock:
+            self.Runs = {key: {int(run): tuple(value) for run, value in runs.items()} for key, runs in data["runs"].items()}
+            self.Sums = data["sums"]
+
+    def Save(self, File: Union[str, None] = None):
+        File = File or self.File
+        if File is None:
+            raise ValueError("No file to save the flux accumulator to!")
+        with self._lock:
+            data = {
+                "runs": {key: {str(run): value for run, value in runs.items()} for key, runs in self.Runs.items()},
+                "sums": self.Sums
+            }
+            writeAtomically(File, lambda f: json.dump(data, f))
@@ -0,0 +1,80 @@
+import os
+import bisect
+import ROOT
+from typing import Union
+from SndlhcGeo import GeoInterface
+
+
+_geoInterfaces = {}
+_alignments = {}
+# (path, mtime) of the geometry currently loaded into gGeoManager
+_loadedGeofile = None
+
+# First runs of the periods with distinct alignment constants. Runs within
+# the same period share the alignment, so consecutive datasets from one
+# period do not need to re-run InitEvent. With no boundaries every run is
+# treated as its own period.
+alignmentPeriods = []
+
+
+def getGeoInterface(geofile: str) -> GeoInterface:
+    """
+    Return the GeoInterface for `geofile`, loading the geometry only when
+    it is not the one currently in gGeoManager. The cache is keyed by the
+    absolute path and the file mtime.
+
+    The Scifi and MuFilter modules navigate through the global gGeoManager,
+    so an interface is only valid while its geometry is the loaded one:
+    switching to another geofile drops the cached interface (and its
+    alignment) and imports the geometry again.
+    """
+    global _loadedGeofile
+    path = os.path.abspath(geofile)
+    key = (path, os.path.getmtime(path))
+
+    if key != _loadedGeofile or key not in _geoInterfaces:
+        _geoInterfaces.clear()
+        _alignments.clear()
+        _geoInterfaces[key] = GeoInterface(geofile)
+        _loadedGeofile = key
+    return _geoInterfaces[key]
+
+
+def setAlignmentPeriods(firstRuns: list):
+    alignmentPeriods[:] = sorted(int(run) for run in firstRuns)
+    _alignments.clear()
+
+
+def getAlignmentPeriod(run: Union[int, None]):
+    if run is None:
+        return None
+    if not alignmentPeriods:
+        return int(run)
+    return bisect.bisect_right(alignmentPeriods, int(run))
+
+
+def initAlignment(
+    geoInterface: GeoInterface,
+    tree: ROOT.TChain,
+    run: Union[int, None] = None,
+    force: bool = False,
+    entry: int = 0
+) -> bool:
+    """
+    Initialize the Scifi and MuFilter alignment from event `entry` of
+    `tree`, unless the shared modules are already set up for the alignment
+    period of `run`. Without a run (e.g. MC) the period is unknown, so the
+    alignment is always taken from the event header of `tree`.
+
+    Returns:
+        bool: True if InitEvent was called, False if the cached alignment was reused
+    """
+    period = getAlignmentPeriod(run)
+    if not force and period is not None and _alignments.get(id(geoInterface)) == period:
+        return False
+
+    tree.GetEntry(entry)
+    geoInterface.modules["Scifi"].InitEvent(tree.EventHeader)
+    geoInterface.modules["MuFilter"].InitEvent(tree.EventHeader)
+    _alignments[id(geoInterface)] = period
+    return True
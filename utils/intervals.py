@@ -0,0 +1,430 @@
+import os
+import numpy as np
+from scipy.special import betainc, betaincinv, ndtri, gammaln, xlogy
+from scipy.stats import beta as beta_dist
+from utils.cache import getCacheDir, writeAtomically, LruCache
+
+
+# Canonical statistic options (named after the TEfficiency ones) and the
+# spellings accepted for each of them
+STAT_OPTIONS = {
+    "normal":          {"normal", "kfnormal"},
+    "clopper_pearson": {"clopper_pearson", "kfcp", "clopper pearson",
+                        "clopper-pearson", "clopper.pearson",
+                        "clopper:pearson", "clopperpearson"},
+    "bayesian":        {"bayesian", "kbbayesian"},
+    "wilson":          {"wilson", "kfwilson"},
+    "feldman_cousins": {"feldman_cousins", "kffc",
+                        "feldman cousins", "feldman-cousins",
+                        "feldman-cousings", "feldman:cousins",
+                        "feldman.cousins", "feldmancousins"},
+    "agresti_coull":   {"agresti_coull", "kfac",
+                        "agresti coull", "agresti-coull",
+                        "agresti:coull", "agresti.coull",
+                        "agresticoull"},
+    "mid_p_interval":  {"mid_p_interval", "kmidp",
+                        "mid p interval", "mid-p-interval",
+                        "mid:p:interval", "mid.p.interval",
+                        "midpinterval"},
+    "jeffrey":         {"jeffrey", "kbjeffrey"},
+    "uniform_prior":   {"uniform_prior", "kbuniform",
+                        "uniform prior", "uniform-prior",
+                        "uniform:prior", "uniform.prior",
+                        "uniformprior"}
+}
+
+BAYESIAN_PRIORS = {"bayesian": None, "jeffrey": (0.5, 0.5), "uniform_prior": (1, 1)}
+
+
+
+def parseStatOption(statOption: str) -> str:
+    """
+    Canonical name of a statistic option, e.g. 'kFCP' -> 'clopper_pearson'.
+    """
+    option = statOption.lower()
+    for name, aliases in STAT_OPTIONS.items():
+        if option in aliases:
+            return name
+    raise ValueError(f"Invalid statistic option '{statOption}'! Allowed options are: {', '.join(STAT_OPTIONS)}")
+
+
+
+def _getClKey(cl: float) -> float:
+    # 0.682689 and 0.6826894921370859 are both used as the 1-sigma default
+    return round(float(cl), 6)
+
+
+def _normal(passed, total, cl):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        average = passed / total
+        delta = ndtri(1 - (1 - cl) / 2) * np.sqrt(average * (1 - average) / total)
+    return np.maximum(average - delta, 0), np.minimum(average + delta, 1)
+
+
+def _wilson(passed, total, cl):
+    kappa = ndtri(1 - (1 - cl) / 2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        average = passed / total
+        mode = (passed + 0.5 * kappa**2) / (total + kappa**2)
+        delta = kappa / (total + kappa**2) * np.sqrt(total * average * (1 - average) + kappa**2 / 4)
+    return np.maximum(mode - delta, 0), np.minimum(mode + delta, 1)
+
+
+def _agrestiCoull(passed, total, cl):
+    kappa = ndtri(1 - (1 - cl) / 2)
+    mode = (passed + 0.5 * kappa**2) / (total + kappa**2)
+    delta = kappa * np.sqrt(mode * (1 - mode) / (total + kappa**2))
+    return np.maximum(mode - delta, 0), np.minimum(mode + delta, 1)
+
+
+def _clopperPearson(passed, total, cl):
+    alpha = (1 - cl) / 2
+    with np.errstate(invalid="ignore"):
+        lower = np.where(passed > 0, betaincinv(passed, total - passed + 1, alpha), 0.0)
+        upper = np.where(passed < total, betaincinv(passed + 1, total - passed, 1 - alpha), 1.0)
+    return lower, upper
+
+
+def _betaCentral(a, b, cl):
+    with np.errstate(invalid="ignore"):
+        lower = np.where((a > 0) & (b > 0), betaincinv(a, b, (1 - cl) / 2), 0.0)
+        upper = np.where((a > 0) & (b > 0), betaincinv(a, b, (1 + cl) / 2), 1.0)
+    return lower, upper
+
+
+def _midP(passed, total, cl, tol: float = 1e-9):
+    # Equal-tailed mid-p interval by bisection on all bins at once, as in
+    # TEfficiency::MidPInterval. The binomial pmf and cdf are written through
+    # the beta distribution, so non-integer (weighted) counts are continuous,
+    # and 0 < passed < 1 interpolates linearly between passed = 0 and 1.
+    alphaMin = (1 - cl) / 2
+    nIter = int(np.ceil(np.log2(1 / tol)))
+
+    def bisect(k, n, target):
+        # 0.5 * P(X = k) + P(X < k) decreases with p
+        def tail(p):
+            with np.errstate(invalid="ignore"):
+                below = np.where(k >= 1, betainc(n - k + 1, np.maximum(k, 1), 1 - p), 0.0)
+            return 0.5 * beta_dist.pdf(p, k + 1, n - k + 1) / (n + 1) + below
+
+        pMin, pMax = np.zeros_like(k), np.ones_like(k)
+        for _ in range(nIter):
+            p = 0.5 * (pMin + pMax)
+            above = tail(p) > target
+            pMin, pMax = np.where(above, p, pMin), np.where(above, pMax, p)
+        return 0.5 * (pMin + pMax)
+
+    def limits(k, n):
+        return bisect(k, n, 1 - alphaMin), bisect(k, n, alphaMin)
+
+    lower, upper = limits(passed, total)
+    frac = (passed > 0) & (passed < 1)
+    if frac.any():
+        k, n = passed[frac], total[frac]
+        lower0, upper0 = limits(np.zeros_like(k), n)
+        lower1, upper1 = limits(np.ones_like(k), n)
+        lower[frac] = lower0 + (lower1 - lower0) * k
+        upper[frac] = upper0 + (upper1 - upper0) * k
+    return np.where(passed > 0, lower, 0.0), np.where(passed < total, upper, 1.0)
+
+
+def _feldmanCousinsN(n: int, cl: float, nRho: int, chunkSize: int = 2_000_000) -> tuple:
+    # Neyman construction with likelihood-ratio ordering on a grid of rho,
+    # giving the (lower, upper) limits for every x = 0..n of a given total n
+    x = np.arange(n + 1)
+    logBinom = gammaln(n + 1) - gammaln(x + 1) - gammaln(n - x + 1)
+
+    def pmf(rho):
+        return np.exp(logBinom + xlogy(x, rho) + xlogy(n - x, 1 - rho))
+
+    rhoHat = x / n if n > 0 else x.astype(np.float64)
+    pBest = pmf(rhoHat)
+
+    lower = np.full(n + 1, np.inf)
+    upper = np.full(n + 1, -np.inf)
+    rhos = np.linspace(0, 1, nRho + 1)
+    step = max(chunkSize // (n + 1), 1)
+
+    for start in range(0, len(rhos), step):
+        rho = rhos[start:start + step, None]
+        p = pmf(rho)
+        order = np.argsort(-(p / pBest), axis=1, kind="stable")
+        pSorted = np.take_along_axis(p, order, axis=1)
+        # x enters the acceptance region while the probability summed before it is still below cl
+        acceptedSorted = (np.cumsum(pSorted, axis=1) - pSorted) < cl
+        accepted = np.empty_like(acceptedSorted)
+        np.put_along_axis(accepted, order, acceptedSorted, axis=1)
+
+        lower = np.minimum(lower, np.where(accepted, rho, np.inf).min(axis=0))
+        upper = np.maximum(upper, np.where(accepted, rho, -np.inf).max(axis=0))
+
+    lower[~np.isfinite(lower)] = 0.0
+    upper[~np.isfinite(upper)] = 1.0
+    return lower, upper
+
+
+FC_CACHE_SIZE = 512
+_fcCache = LruCache(FC_CACHE_SIZE)
+
+
+def _getFeldmanCousinsN(n: int, cl: float, nRho: int) -> tuple:
+    return _fcCache.GetOrCreate((n, cl, nRho), lambda: _feldmanCousinsN(n, cl, nRho))
+
+
+def _feldmanCousins(passed, total, cl, nRho: int = 20000):
+    if np.any(passed != np.floor(passed)) or np.any(total != np.floor(total)):
+        raise ValueError("Feldman-Cousins intervals are only defined for integer counts!")
+
+    lower = np.zeros_like(passed)
+    upper = np.ones_like(passed)
+    for n in np.unique(total):
+        mask = total == n
+        lowerN, upperN = _getFeldmanCousinsN(int(n), cl, nRho)
+        x = passed[mask].astype(np.int64)
+        lower[mask], upper[mask] = lowerN[x], upperN[x]
+    return lower, upper
+
+
+_FREQUENTIST = {
+    "normal":          _normal,
+    "clopper_pearson": _clopperPearson,
+    "wilson":          _wilson,
+    "feldman_cousins": _feldmanCousins,
+    "agresti_coull":   _agrestiCoull,
+    "mid_p_interval":  _midP
+}
+
+
+
+def _getPrior(option: str, alpha: float, beta: float) -> tuple:
+    return BAYESIAN_PRIORS[option] or (alpha, beta)
+
+
+def _getEfficiency(option: str, passed, total, alpha: float, beta: float):
+    if option in BAYESIAN_PRIORS:
+        a, b = _getPrior(option, alpha, beta)
+        return (passed + a) / (total + a + b)
+    return np.where(total > 0, passed / np.where(total > 0, total, 1.0), 0.0)
+
+
+def _getLimits(option: str, passed, total, cl: float, alpha: float, beta: float) -> tuple:
+    if option in BAYESIAN_PRIORS:
+        a, b = _getPrior(option, alpha, beta)
+        return _betaCentral(passed + a, total - passed + b, cl)
+
+    empty = total <= 0
+    lower, upper = _FREQUENTIST[option](np.where(empty, 0.0, passed), np.where(empty, 1.0, total), cl)
+    return np.where(empty, 0.0, lower), np.where(empty, 1.0, upper)
+
+
+
+class IntervalTable:
+    """
+    Dense table of the interval limits of every integer pair
+    0 <= passed <= total <= NMax, for one statistic option and confidence
+    level, stored as an npz file under the cache directory.
+    """
+
+    def __init__(self,
+        StatOption: str = "Clopper Pearson",
+        CL: float = 0.6826894921370859,
+        NMax: int = 1000,
+        Alpha: float = 1,
+        Beta: float = 1
+    ):
+        self.StatOption = parseStatOption(StatOption)
+        self.CL = float(CL)
+        self.NMax = int(NMax)
+        self.Alpha, self.Beta = _getPrior(self.StatOption, Alpha, Beta) if self.StatOption in BAYESIAN_PRIORS else (1, 1)
+        self.Lower = None
+        self.Upper = None
+
+    @property
+    def Key(self) -> tuple:
+        return (self.StatOption, _getClKey(self.CL), self.Alpha, self.Beta)
+
+    def GetPath(self) -> str:
+        name = f"{self.StatOption}_cl{self.CL:.6f}_n{self.NMax}"
+        if self.StatOption in BAYESIAN_PRIORS:
+            name = f"{name}_a{self.Alpha:g}_b{self.Beta:g}"
+        return os.path.join(getCacheDir(), "intervals", f"{name}.npz")
+
+    def Build(self):
+        total, passed = np.tril_indices(self.NMax + 1)
+        lower, upper = _getLimits(self.StatOption, passed.astype(np.float64), total.astype(np.float64), self.CL, self.Alpha, self.Beta)
+
+        self.Lower = np.zeros((self.NMax + 1, self.NMax + 1))
+        self.Upper = np.ones((self.NMax + 1, self.NMax + 1))
+        self.Lower[total, passed] = lower
+        self.Upper[total, passed] = upper
+
+    def Load(self) -> bool:
+        path = self.GetPath()
+        if not os.path.exists(path):
+            return False
+        with np.load(path) as cached:
+            self.Lower, self.Upper = cached["lower"], cached["upper"]
+        return True
+
+    def Save(self):
+        writeAtomically(self.GetPath(), lambda f: np.savez_compressed(f, lower=self.Lower, upper=self.Upper), binary=True)
+
+    def Covers(self, passed: np.ndarray, total: np.ndarray) -> np.ndarray:
+        return (total <= self.NMax) & (passed >= 0) & (passed <= total) & \
+               (passed == np.floor(passed)) & (total == np.floor(total))
+
+    def Lookup(self, passed: np.ndarray, total: np.ndarray) -> tuple:
+        """
+        Limits of pairs covered by the table (see Covers).
+        """
+        total, passed = total.astype(np.int64), passed.astype(np.int64)
+        return self.Lower[total, passed], self.Upper[total, passed]
+
+
+
+_intervalTables = {}
+
+def getIntervalTable(
+    statOption: str = "Clopper Pearson",
+    cl: float = 0.6826894921370859,
+    nMax: int = 1000,
+    alpha: float = 1,
+    beta: float = 1,
+    persist: bool = True
+) -> IntervalTable:
+    """
+    Load (or build and, with `persist`, save) the dense interval table for
+    totals up to `nMax`. Once loaded, getEffIntervals uses it for every
+    call with the same statistic option and confidence level.
+
+    Building a Feldman-Cousins table needs a Neyman construction for every
+    total, so keep `nMax` moderate (a few hundred) for that option.
+    """
+    table = IntervalTable(statOption, cl, nMax, alpha, beta)
+    if not table.Load():
+        table.Build()
+        if persist:
+            table.Save()
+
+    current = _intervalTables.get(table.Key)
+    if current is None or current.NMax <= table.NMax:
+        _intervalTables[table.Key] = table
+    return table
+
+
+INTERVAL_CACHE_SIZE = 100_000
+_intervalCache = LruCache(INTERVAL_CACHE_SIZE)
+
+# Options with quantile/root-finding limits, worth deduplicating per
+# (passed, total) pair, and the subset that is also memoized pair by pair
+# (FC is memoized per total). The closed-form options are cheaper to
+# recompute than to look up.
+DEDUP_OPTIONS = {"clopper_pearson", "feldman_cousins", "mid_p_interval", *BAYESIAN_PRIORS}
+MEMO_OPTIONS = {"mid_p_interval"}
+
+
+def clearIntervalCache(tables: bool = False):
+    _intervalCache.Clear()
+    _fcCache.Clear()
+    if tables:
+        _intervalTables.clear()
+
+
+def _getMemoizedLimits(option: str, passed, total, cl: float, alpha: float, beta: float) -> tuple:
+    # Pair LRU for integer counts, vectorized computation of the misses
+    lower = np.empty_like(passed)
+    upper = np.empty_like(passed)
+
+    integer = (passed == np.floor(passed)) & (total == np.floor(total))
+    if not 0 < integer.sum() <= INTERVAL_CACHE_SIZE:
+        return _getLimits(option, passed, total, cl, alpha, beta)
+
+    prefix = (option, _getClKey(cl), alpha, beta)
+    keys = [(*prefix, p, t) for p, t in zip(passed.tolist(), total.tolist())]
+    hits = _intervalCache.GetMany(keys)
+
+    todo = np.array([hit is None for hit in hits])
+    if (~todo).any():
+        lower[~todo], upper[~todo] = np.array([hit for hit in hits if hit is not None]).T
+
+    if todo.any():
+        lower[todo], upper[todo] = _getLimits(option, passed[todo], total[todo], cl, alpha, beta)
+        _intervalCache.PutMany((keys[i], (lower[i], upper[i])) for i in np.flatnonzero(todo & integer).tolist())
+
+    return lower, upper
+
+
+def _getCachedLimits(option: str, passed, total, cl: float, alpha: float, beta: float) -> tuple:
+    # Dense table where available, then the pair LRU (expensive options only)
+    # or a direct vectorized computation of whatever is left
+    prior = _getPrior(option, alpha, beta) if option in BAYESIAN_PRIORS else (1, 1)
+    table = _intervalTables.get((option, _getClKey(cl), *prior))
+    compute = _getMemoizedLimits if option in MEMO_OPTIONS else _getLimits
+
+    if table is None:
+        return compute(option, passed, total, cl, alpha, beta)
+
+    lower = np.empty_like(passed)
+    upper = np.empty_like(passed)
+    covered = table.Covers(passed, total)
+    lower[covered], upper[covered] = table.Lookup(passed[covered], total[covered])
+    if not covered.all():
+        lower[~covered], upper[~covered] = compute(option, passed[~covered], total[~covered], cl, alpha, beta)
+    return lower, upper
+
+
+
+def getEffIntervals(
+    passed,
+    total,
+    statOption: str = "Clopper Pearson",
+    cl: float = 0.6826894921370859,
+    alpha: float = 1,
+    beta: float = 1
+) -> tuple:
+    """
+    Efficiencies and asymmetric errors for arrays of passed/total counts of
+    any shape, following ROOT's TEfficiency for the same statistic option
+    and confidence level.
+
+    Frequentist options use passed/total as the efficiency, the Bayesian
+    ones (Bayesian, Jeffrey, Uniform Prior) the posterior mean. Bins with
+    zero total get an efficiency of 0 and the full [0, 1] interval for the
+    frequentist options; the Bayesian ones return the prior mean and the
+    central interval of the prior, as TEfficiency does.
+
+    Limits come from a dense table when one was loaded with
+    getIntervalTable (matched on the confidence level rounded to 6
+    digits). Otherwise the expensive options are computed once per unique
+    pair, and mid-P integer pairs are memoized in an LRU.
+
+    Args:
+        passed: Number of successes
+        total: Total number of trials
+        statOption: Statistic option (see STAT_OPTIONS)
+        cl: Confidence level (default is 1-sigma)
+        alpha: Prior alpha parameter for the 'Bayesian' option
+        beta: Prior beta parameter for the 'Bayesian' option
+
+    Returns:
+        tuple: (efficiency, upper error, lower error) arrays of the input shape
+    """
+    option = parseStatOption(statOption)
+    passed, total = np.broadcast_arrays(np.asarray(passed, dtype=np.float64), np.asarray(total, dtype=np.float64))
+    shape = passed.shape
+
+    if option in DEDUP_OPTIONS:
+        # Intervals only depend on the (passed, total) pair, so compute each pair once
+        pairs, inverse = np.unique(passed.ravel() + 1j * total.ravel(), return_inverse=True)
+        inverse = inverse.ravel()
+        uPassed, uTotal = pairs.real, pairs.imag
+    else:
+        inverse = slice(None)
+        uPassed, uTotal = passed.ravel(), total.ravel()
+
+    eff = _getEfficiency(option, uPassed, uTotal, alpha, beta)
+    lower, upper = _getCachedLimits(option, uPassed, uTotal, cl, alpha, beta)
+
+    errUp = np.abs(upper - eff)[inverse].reshape(shape)
+    errLow = np.abs(eff - lower)[inverse].reshape(shape)
+    return eff[inverse].reshape(shape), errUp, errLow
@@ -0,0 +1,348 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+import uproot
+import matplotlib.pyplot as plt
+from typing import Union
+from utils.cache import getCacheDir, writeAtomically, LruCache
+
+
+LUMI_DIRS = {
+    "atlas_lumi":    "/eos/experiment/sndlhc/atlas_lumi",
+    "atlas_lumi_hi": "/eos/experiment/sndlhc/atlas_lumi_hi"
+}
+
+
+def getLumiFile(fill: int, source: str = "atlas_lumi") -> str:
+    if source not in LUMI_DIRS:
+        raise ValueError(f"Invalid luminosity source '{source}'! Allowed sources are: {', '.join(LUMI_DIRS)}")
+    return f"{LUMI_DIRS[source]}/fill_{int(fill):06d}.root"
+
+
+LUMI_CACHE_SIZE = 64
+_lumiCache = LruCache(LUMI_CACHE_SIZE)
+
+
+def _readLumiFile(path: str) -> tuple:
+    with uproot.open(path) as f:
+        arrays = f["atlas_lumi"].arrays(["unix_timestamp", "var"], library="np")
+    return (
+        np.asarray(arrays["unix_timestamp"], dtype=np.float64),
+        np.asarray(arrays["var"], dtype=np.float64)
+    )
+
+
+def readLumiArrays(fill: int, source: str = "atlas_lumi") -> Union[tuple, None]:
+    """
+    Read the timestamps and instantaneous luminosity of a fill.
+
+    Decoded arrays are kept in an in-memory LRU and in an npz copy under
+    the cache directory, keyed by fill, source and the mtime of the source
+    file, so a fill is read from EOS at most once.
+
+    Returns:
+        tuple: Read-only (unix_timestamp, var) numpy arrays, or None if there is no file for the fill
+    """
+    key = (int(fill), source)
+    arrays = _lumiCache.Get(key)
+    if arrays is not None:
+        return arrays
+
+    path = getLumiFile(fill, source)
+    cachePath = os.path.join(getCacheDir(), "lumi", f"{source}_fill_{int(fill):06d}.npz")
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+
+    if os.path.exists(cachePath):
+        with np.load(cachePath) as cached:
+            if mtime is None or float(cached["mtime"]) == mtime:
+                arrays = (cached["unix_timestamp"], cached["var"])
+
+    if arrays is None:
+        if mtime is None:
+            return None
+
+        arrays = _readLumiFile(path)
+        writeAtomically(
+            cachePath,
+            lambda f: np.savez_compressed(f, unix_timestamp=arrays[0], var=arrays[1], mtime=mtime),
+            binary = True
+        )
+
+    for array in arrays:
+        array.setflags(write=False)
+
+    _lumiCache.Put(key, arrays)
+    return arrays
+
+
+def clearLumiCache():
+    _lumiCache.Clear()
+    _lumiIndices.Clear()
+    _lumiProfiles.Clear()
+
+
+def integrateLumi(
+    timestamps: np.ndarray,
+    lumi: np.ndarray,
+    Ti: float = 0,
+    Tf: float = 1e12,
+    maxGap: float = 600
+) -> float:
+    """
+    Integrate the instantaneous luminosity over the records in [Ti, Tf].
+
+    Records are read in order until the first one after `Tf`; intervals
+    longer than `maxGap` seconds are treated as gaps and skipped.
+
+    Returns:
+        float: Integrated luminosity (instantaneous units x s / 1e3)
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    lumi = np.asarray(lumi, dtype=np.float64)
+
+    after = np.flatnonzero(timestamps > Tf)
+    stop = after[0] if after.size else timestamps.size
+    selected = timestamps[:stop] >= Ti
+
+    timestamps = timestamps[:stop][selected]
+    lumi = lumi[:stop][selected]
+    if timestamps.size < 2:
+        return 0.0
+
+    deltas = np.diff(timestamps)
+    mask = deltas < maxGap
+    return float(np.sum(deltas[mask] * lumi[1:][mask]) / 1e3)
+
+
+def getFillLumi(
+    fill: int,
+    source: str = "atlas_lumi",
+    Ti: float = 0,
+    Tf: float = 1e12
+) -> Union[float, None]:
+    arrays = readLumiArrays(fill, source)
+    if arrays is None:
+        return None
+    return integrateLumi(*arrays, Ti=Ti, Tf=Tf)
+
+
+
+class LumiIndex:
+    """
+    Cumulative luminosity of a fill for fast time-window integrals.
+
+    Keeps the time-ordered timestamps and the prefix sum of the interval
+    contributions (same 600 s gap rule as integrateLumi), so the integral
+    over any window is two binary searches and a difference.
+    """
+
+    def __init__(self,
+        Timestamps: np.ndarray,
+        Lumi: np.ndarray,
+        MaxGap: float = 600
+    ):
+        Timestamps = np.asarray(Timestamps, dtype=np.float64)
+        Lumi = np.asarray(Lumi, dtype=np.float64)
+        order = np.argsort(Timestamps, kind="stable")
+
+        self.Timestamps = Timestamps[order]
+        self.Lumi = Lumi[order]
+        self.MaxGap = MaxGap
+
+        deltas = np.diff(self.Timestamps)
+        contributions = np.where(deltas < MaxGap, deltas * self.Lumi[1:], 0.)
+        self.Cumulative = np.concatenate(([0.], np.cumsum(contributions))) / 1e3
+
+    @classmethod
+    def FromFill(cls, fill: int, source: str = "atlas_lumi", MaxGap: float = 600):
+        arrays = readLumiArrays(fill, source)
+        if arrays is None:
+            return None
+        return cls(*arrays, MaxGap=MaxGap)
+
+    def Integrate(self,
+        Ti: Union[float, np.ndarray] = 0,
+        Tf: Union[float, np.ndarray] = 1e12
+    ) -> Union[float, np.ndarray]:
+        """
+        Integrated luminosity in [Ti, Tf]; Ti and Tf may be arrays of windows.
+        """
+        first = np.searchsorted(self.Timestamps, Ti, side="left")
+        last = np.searchsorted(self.Timestamps, Tf, side="right") - 1
+
+        first = np.minimum(first, len(self.Cumulative) - 1)
+        last = np.maximum(last, 0)
+        integrated = np.where(last > first, self.Cumulative[last] - self.Cumulative[first], 0.)
+
+        if np.ndim(integrated) == 0:
+            return float(integrated)
+        return integrated
+
+    def GetTotal(self) -> float:
+        return float(self.Cumulative[-1])
+
+
+
+class LumiProfile(LumiIndex):
+    """
+    Luminosity profile of a fill with precomputed summary quantities
+    (start, end, peak, threshold crossing times, cumulative luminosity)
+    and decimated plotting.
+    """
+
+    def __init__(self,
+        Timestamps: np.ndarray,
+        Lumi: np.ndarray,
+        MaxGap: float = 600,
+        Fill: Union[int, None] = None
+    ):
+        super().__init__(Timestamps, Lumi, MaxGap)
+        if self.Timestamps.size == 0:
+            raise ValueError("Cannot build a luminosity profile without records!")
+
+        self.Fill = Fill
+        self.Start = float(self.Timestamps[0])
+        self.End = float(self.Timestamps[-1])
+        iPeak = int(np.argmax(self.Lumi))
+        self.Peak = float(self.Lumi[iPeak])
+        self.PeakTime = float(self.Timestamps[iPeak])
+
+        self._thresholdTimes = {}
+        self._decimated = {}
+        self.GetThresholdTime(0.95)
+
+    @classmethod
+    def FromFill(cls, fill: int, source: str = "atlas_lumi", MaxGap: float = 600):
+        arrays = readLumiArrays(fill, source)
+        if arrays is None:
+            return None
+        return cls(*arrays, MaxGap=MaxGap, Fill=fill)
+
+    def GetThresholdTime(self, fraction: float = 0.95) -> Union[float, None]:
+        """
+        Time of the first record below `fraction` of the peak luminosity.
+        """
+        if fraction not in self._thresholdTimes:
+            below = np.flatnonzero(self.Lumi < fraction * self.Peak)
+            self._thresholdTimes[fraction] = float(self.Timestamps[below[0]]) if below.size else None
+        return self._thresholdTimes[fraction]
+
+    def GetTimes(self, fraction: float = 0.95) -> tuple:
+        return self.Start, self.GetThresholdTime(fraction), self.End
+
+    def GetDecimated(self, maxPoints: int = 2000) -> tuple:
+        """
+        Min/max decimation: the records are split into maxPoints/2 buckets
+        and each bucket is represented by its minimum and maximum.
+        """
+        if self.Timestamps.size <= maxPoints:
+            return self.Timestamps, self.Lumi
+
+        if maxPoints not in self._decimated:
+            nBuckets = max(maxPoints // 2, 1)
+            edges = np.linspace(0, self.Timestamps.size, nBuckets + 1).astype(np.int64)[:-1]
+            ends = np.append(edges[1:], self.Timestamps.size) - 1
+
+            x = np.repeat(0.5 * (self.Timestamps[edges] + self.Timestamps[ends]), 2)
+            y = np.empty(2 * nBuckets)
+            y[0::2] = np.minimum.reduceat(self.Lumi, edges)
+            y[1::2] = np.maximum.reduceat(self.Lumi, edges)
+            self._decimated[maxPoints] = (x, y)
+        return self._decimated[maxPoints]
+
+    def Plot(self, ax=None, maxPoints: int = 2000, **kwargs):
+        if ax is None:
+            ax = plt.gca()
+        x, y = self.GetDecimated(maxPoints)
+        return ax.plot(x, y, **kwargs)
+
+
+
+_lumiIndices = LruCache(LUMI_CACHE_SIZE)
+_lumiProfiles = LruCache(LUMI_CACHE_SIZE)
+
+def getLumiIndex(fill: int, source: str = "atlas_lumi") -> Union[LumiIndex, None]:
+    return _lumiIndices.GetOrCreate((int(fill), source), lambda: LumiIndex.FromFill(fill, source))
+
+def getLumiProfile(fill: int, source: str = "atlas_lumi") -> Union[LumiProfile, None]:
+    return _lumiProfiles.GetOrCreate((int(fill), source), lambda: LumiProfile.FromFill(fill, source))
+
+
+SUPERTABLE_DIR = "/eos/user/i/idioniso/1_Data"
+
+
+class SupertableStore:
+    """
+    Per-year supertable CSVs, loaded once per process and indexed by fill.
+
+    A table is reloaded only when the mtime of its CSV file changes.
+    """
+
+    def __init__(self, Directory: str = SUPERTABLE_DIR):
+        self.Directory = Directory
+        self.Tables = {}
+        self._lock = threading.Lock()
+
+    def GetPath(self, year: int) -> str:
+        return f"{self.Directory}/supertable{int(year)}.csv"
+
+    def Exists(self, year: int) -> bool:
+        return os.path.exists(self.GetPath(year))
+
+    def GetTable(self, year: int) -> pd.DataFrame:
+        """
+        Return the supertable of a year as a DataFrame indexed by `Fill`.
+        """
+        return self._load(year)["table"]
+
+    def _load(self, year: int) -> dict:
+        path = self.GetPath(year)
+        mtime = os.path.getmtime(path)
+
+        with self._lock:
+            cached = self.Tables.get(int(year))
+            if cached is not None and cached["mtime"] == mtime:
+                return cached
+
+        st = pd.read_csv(path)
+        st["ATLAS Int. Lumi [1/nb]"] = pd.to_numeric(st["ATLAS Int. Lumi [1/nb]"], errors="coerce").astype(float)
+        st["Fill Start"] = pd.to_numeric(st["Fill Start"], errors="coerce")
+        st = st[st["Fill"].notna()].copy()
+        st["Fill"] = st["Fill"].astype(np.int64)
+        st = st.drop_duplicates(subset="Fill", keep="first").set_index("Fill")
+
+        cached = {
+            "mtime": mtime,
+            "table": st,
+            "lumi": st["ATLAS Int. Lumi [1/nb]"].to_dict(),
+            "start": st["Fill Start"].to_dict()
+        }
+        with self._lock:
+            self.Tables[int(year)] = cached
+        return cached
+
+    def GetLumi(self, fill: int, year: int) -> Union[float, None]:
+        lumi = self._load(year)["lumi"].get(int(fill))
+        if lumi is None or np.isnan(lumi):
+            return None
+        return float(lumi)
+
+    def GetFillStart(self, fill: int, year: int) -> Union[float, None]:
+        """
+        Start of a fill as a unix timestamp in seconds.
+        """
+        start = self._load(year)["start"].get(int(fill))
+        if start is None or np.isnan(start):
+            return None
+        return int(start)/1e3
+
+
+
+_supertableStore = None
+
+def getSupertableStore() -> SupertableStore:
+    global _supertableStore
+    if _supertableStore is None:
+        _supertableStore = SupertableStore()
+    return _supertableStore
@@ -7,7 +7,11 @@ import pandas as pd
 import uproot
 import datetime
 from typing import Union
+from concurrent.futures import ThreadPoolExecutor
 from ddfUtils import getSubDirPath, getAllFiles
+from utils.catalog import getRunCatalog, getFileEntries, getFillMap
+from utils.flux import getFluxArrays
+from utils.lumi import getFillLumi, readLumiArrays, getSupertableStore, getLumiIndex, getLumiProfile
 
 def nType(tt: int) -> str:
     if   tt==1  or tt==3:  return 'clusters'
@@ -34,6 +38,50 @@ def getTChain(inputDir: str, files: str) -> ROOT.TChain:
         return None
 
 
+_runMetadata = {}
+
+def getRunMetadata(inputDir: str, files: str = "*.root", refresh: bool = False) -> dict:
+    """
+    Probe a run directory with a single open of its first file.
+
+    Returns a dict with the matching `files`, the `tree` name (cbmsim or
+    rawConv, None if neither exists) and the `timestamp`, `date` and
+    `fill` read from the first EventHeader. Results are memoized per
+    (inputDir, files).
+    """
+    key = (inputDir, files)
+    if key in _runMetadata and not refresh:
+        return dict(_runMetadata[key])
+
+    allFiles = sorted(getAllFiles(inputDir, files))
+    if not allFiles:
+        raise ValueError(f"No files matching '{files}' were found in {inputDir}!")
+
+    metadata = {"files": allFiles, "tree": None, "timestamp": None, "date": None, "fill": None}
+
+    tfile = ROOT.TFile.Open(allFiles[0])
+    if not tfile or tfile.IsZombie():
+        raise ValueError(f"Error opening file: {allFiles[0]}")
+
+    for treeName in ("cbmsim", "rawConv"):
+        ttree = tfile.Get(treeName)
+        if ttree:
+            metadata["tree"] = treeName
+            try:
+                ttree.GetEntry(0)
+                header = ttree.EventHeader
+                metadata["timestamp"] = header.GetUTCtimestamp()
+                metadata["date"] = datetime.datetime.utcfromtimestamp(metadata["timestamp"])
+                metadata["fill"] = int(header.GetFillNumber())
+            except Exception as e:
+                print(f"Error accessing data: {e}")
+            break
+    tfile.Close()
+
+    _runMetadata[key] = metadata
+    return dict(metadata)
+
+
 def getTtFromSys(system: str) -> tuple:
     if system.lower()=="sf" or system.lower()=="scifi":
         return 1, 11
@@ -167,46 +215,32 @@ def dsTrackIsReconstructible(
 
 
 
-def getFill(run: int, jsonFile: str = "/eos/user/i/idioniso/1_Data/sndRuns.json"):
-    def getFillFromJson(
-        run: int,
-        jsonFile: str = "/eos/user/i/idioniso/1_Data/sndRuns.json"
-    ):
-        run = str(run)
-        with open(jsonFile, "r") as f:
-            data = json.load(f)
-        return data.get(run)
-
-    fill = getFillFromJson(run, jsonFile)
-    if fill is None:
-        def getFillFromRoot(run: int):
-            year = getRunYear(run)
-            rootDir = f"/eos/experiment/sndlhc/convertedData/physics/{year}"
-            dataDir = getSubDirPath(RootDir=rootDir, TopDir=f"run_{int(run):06d}")[0]
+def getFillFromRoot(run: int) -> int:
+    fill = getRunCatalog().Get(run, "fill")
+    if fill is not None:
+        return fill
 
-            try:
-                file_ = getAllFiles(dataDir, "*.root")[0]
-                tfile = ROOT.TFile.Open(file_)
-            except Exception as e:
-                raise ValueError(f"Error opening file: {e}")
-                return None
+    try:
+        metadata = getRunMetadata(getRunDirectory(run), "sndsw_raw-*.root")
+    except Exception as e:
+        raise ValueError(f"Error opening file: {e}")
 
-            if tfile.Get("cbmsim"):
-                ttree = tfile.Get("cbmsim")
-            elif tfile.Get("rawConv"):
-                ttree = tfile.Get("rawConv")
-            else:
-                raise ValueError("No tree found")
-                return None
+    if metadata["tree"] is None:
+        raise ValueError("No tree found")
+    if metadata["fill"] is None:
+        raise ValueError(f"Error accessing data for run {run}")
+
+    getRunCatalog().Update(run, fill=metadata["fill"], timestamp=metadata["timestamp"])
+    return metadata["fill"]
 
-            try:
-                ttree.GetEntry(0)
-                return int(ttree.EventHeader.GetFillNumber())
-            except Exception as e:
-                raise ValueError(f"Error accessing data: {e}")
-                return None
 
+def getFill(run: int, jsonFile: str = "/eos/user/i/idioniso/1_Data/sndRuns.json"):
+    fillMap = getFillMap(jsonFile)
+
+    fill = fillMap.GetFill(run)
+    if fill is None:
         fill = getFillFromRoot(run)
+        fillMap.Add(run, fill)
 
     if fill is None:
         raise ValueError(f"Fill number not found for run {run}")
@@ -214,244 +248,147 @@ def getFill(run: int, jsonFile: str = "/eos/user/i/idioniso/1_Data/sndRuns.json"
         return fill
 
 
+def getFills(
+    runs: list,
+    jsonFile: str = "/eos/user/i/idioniso/1_Data/sndRuns.json",
+    nThreads: int = 8
+) -> dict:
+    """
+    Fill numbers of many runs. Runs missing from the run -> fill map are
+    read from their raw data files concurrently.
+    """
+    ROOT.EnableThreadSafety()
+    return getFillMap(jsonFile).Resolve(runs, getFillFromRoot, nThreads)
 
 
+def getFillRuns(fill: int, jsonFile: str = "/eos/user/i/idioniso/1_Data/sndRuns.json") -> list:
+    return getFillMap(jsonFile).GetRuns(fill)
 
-def getRuns(year: int):
-    if year>=2024:
-        path = f"/eos/experiment/sndlhc/convertedData/physics/{year}"
-        runs = []
-        runs0 = [int(re.search(r'run_(\d+)', d1).group(1)) for d1 in os.listdir(path) if re.match(r'run_\d+', d1)]
-        for run0 in runs0:
-            for d2 in os.listdir(f'{path}/run_{run0}'):
-                if re.match(r'run_\d+', d2):
-                    runs.append(int(re.search(r'run_(\d+)', d2).group(1)) )
-        return runs
 
-    path = f"/eos/experiment/sndlhc/convertedData/physics/{year}"
-    runs = [int(re.search(r'run_(\d+)', d).group(1)) for d in os.listdir(path) if re.match(r'run_\d+', d)]
-    return runs
 
 
-def getRunYear(run: int) -> int:
-    yi = 2022
-    yf = datetime.date.today().year
 
-    for y in range(yi, yf+1):
-        runs = getRuns(y)
+def getRuns(year: int):
+    return getRunCatalog().GetRuns(year)
 
-        if run in runs:
-            return y
 
-    raise ValueError(f"Run {run} was not found!")
+def getRunYear(run: int) -> int:
+    return getRunCatalog().GetYear(run)
 
 
 def getRunDirectory(run: int) -> str:
-    year = getRunYear(run)
-    if year == 2024:
-        path = f"/eos/experiment/sndlhc/convertedData/physics/2024/run_2412/run_{run:06d}"
-    else:
-        path = f"/eos/experiment/sndlhc/convertedData/physics/{year}/run_{run:06d}"
-    return path
+    return getRunCatalog().GetDirectory(run)
 
 
 def getRunFiles(run: int):
-    runDir = getRunDirectory(run)
-
-    rootFiles = glob.glob(
-        os.path.join(runDir, "sndsw_raw-*.root")
-    )
-    return rootFiles
+    return getRunCatalog().GetFiles(run)
 
 
 def getRunEntries(run: int) -> int:
-    dir = getRunDirectory(run)
-    tree = ROOT.TChain("cbmsim")
-    tree.Add(f"{dir}/sndsw_raw-*.root")
-
-    nEntries = tree.GetEntries()
-    if nEntries == 0:
-        tree = ROOT.TChain("rawConv")
-        tree.Add(f"{dir}/sndsw_raw-*.root")
-        nEntries = tree.GetEntries()
-
+    nEntries = sum(getFileEntries(getRunFiles(run)).values())
+    getRunCatalog().Update(run, entries=nEntries)
     return nEntries
 
 
 
 
 def getLumiEosDec(run: int, Ti: float = 0, Tf: float = 1e12) -> float:
-    def makeUnixTime(year, month, day, hour, minute, second) :
-        dt = datetime.datetime(year, month, day, hour, minute, second)
-        return time.mktime(dt.timetuple())
-
-    atlas_online_lumi = ROOT.TChain("atlas_lumi")
-
-    fill = getFill(run)
-
-    input_dir = "/eos/experiment/sndlhc/atlas_lumi"
-    atlas_online_lumi.Add(f"{input_dir}/fill_{fill:06d}.root")
-
-    delivered_inst_lumi = []
-    delivered_unix_timestamp = []
-    delivered_run_number = []
-    delivered_fill_number = []
-    fill = 0
-
-    for entry in atlas_online_lumi :
-        ts = entry.unix_timestamp
-        if ts < Ti:
-            continue
-        elif ts > Tf:
-            break
-
-        delivered_inst_lumi.append(entry.var)
-        delivered_unix_timestamp.append(ts)
-
-    recorded_mask = np.array(True)
-    delivered_inst_lumi = np.array(delivered_inst_lumi)
-    delivered_unix_timestamp = np.array(delivered_unix_timestamp)
-
-    delivered_deltas = delivered_unix_timestamp[1:] - delivered_unix_timestamp[:-1]
-    delivered_mask = delivered_deltas < 600
-
-    delivered_run = np.logical_and(delivered_unix_timestamp[1:] > fill, delivered_mask)
-
-
-    return np.cumsum(
-        np.multiply(
-            delivered_deltas[delivered_run], delivered_inst_lumi[1:][delivered_run]
-        )
-    )[-1]/1e3
+    index = getLumiIndex(getFill(run), "atlas_lumi")
+    if index is None:
+        return None
+    return index.Integrate(Ti, Tf)
 
 
 
 def getLumiDf(run: int):
-    return uproot.open(f"/eos/experiment/sndlhc/atlas_lumi/fill_{getFill(run):06d}.root")["atlas_lumi"].arrays(library="pd")
+    arrays = readLumiArrays(getFill(run), "atlas_lumi")
+    if arrays is None:
+        raise FileNotFoundError(f"No luminosity file was found for run {run}!")
+    return pd.DataFrame({"unix_timestamp": arrays[0], "var": arrays[1]})
 
 def plotLumi(run: int, showPlot: bool = True):
-    df = getLumiDf(run)
-    plt.plot(df["unix_timestamp"], df["var"], label=f"Run {run} (fill {getFill(run)})")
+    fill = getFill(run)
+    profile = getLumiProfile(fill, "atlas_lumi")
+    if profile is None:
+        raise FileNotFoundError(f"No luminosity file was found for run {run}!")
+    profile.Plot(label=f"Run {run} (fill {fill})")
     if showPlot:
         plt.show()
 
 def getLumiTimes(run: int):
-    df = getLumiDf(run)
-    t0 = df.iloc[0]["unix_timestamp"]
-    tf = df.iloc[-1]["unix_timestamp"]
-    threshold = 0.95 * df["var"].max()
-    ti = df[df["var"] < threshold].iloc[0]["unix_timestamp"]
-
-    return t0, ti, tf
+    profile = getLumiProfile(getFill(run), "atlas_lumi")
+    if profile is None:
+        raise FileNotFoundError(f"No luminosity file was found for run {run}!")
+    return profile.GetTimes(0.95)
 
 
 def getLumiEos(run: int) -> float:
-    def makeUnixTime(year, month, day, hour, minute, second) :
-        dt = datetime.datetime(year, month, day, hour, minute, second)
-        return time.mktime(dt.timetuple())
-
-    atlas_online_lumi = ROOT.TChain("atlas_lumi")
-
-    fill = getFill(run)
-
-    input_dir = "/eos/experiment/sndlhc/atlas_lumi"
-    file_path = f"{input_dir}/fill_{fill:06d}.root"
-    if not os.path.exists(file_path):
-        return None
-
-    atlas_online_lumi.Add(file_path)
-
-    delivered_inst_lumi = []
-    delivered_unix_timestamp = []
-    delivered_run_number = []
-    delivered_fill_number = []
-    fill = 0
-
-    for entry in atlas_online_lumi :
-        delivered_inst_lumi.append(entry.var)
-        delivered_unix_timestamp.append(entry.unix_timestamp)
-
-    recorded_mask = np.array(True)
-    delivered_inst_lumi = np.array(delivered_inst_lumi)
-    delivered_unix_timestamp = np.array(delivered_unix_timestamp)
-
-    delivered_deltas = delivered_unix_timestamp[1:] - delivered_unix_timestamp[:-1]
-    delivered_mask = delivered_deltas < 600
-
-    delivered_run = np.logical_and(delivered_unix_timestamp[1:] > fill, delivered_mask)
-
-
-    return np.cumsum(
-        np.multiply(
-            delivered_deltas[delivered_run], delivered_inst_lumi[1:][delivered_run]
-        )
-    )[-1]/1e3
+    return getFillLumi(getFill(run), "atlas_lumi")
 
 
 
 def getLumiEosHi(run: int):
-    def makeUnixTime(year, month, day, hour, minute, second) :
-        dt = datetime.datetime(year, month, day, hour, minute, second)
-        return time.mktime(dt.timetuple())
-
-    atlas_online_lumi = ROOT.TChain("atlas_lumi")
-
-    fill = getFill(run)
-
-    input_dir = "/eos/experiment/sndlhc/atlas_lumi_hi"
-    file_path = f"{input_dir}/fill_{fill:06d}.root"
-    if not os.path.exists(file_path):
-        return None
-
-    atlas_online_lumi.Add(file_path)
-
-    delivered_inst_lumi = []
-    delivered_unix_timestamp = []
-    delivered_run_number = []
-    delivered_fill_number = []
-    fill = 0
-
-    for entry in atlas_online_lumi :
-        delivered_inst_lumi.append(entry.var)
-        delivered_unix_timestamp.append(entry.unix_timestamp)
-
-    recorded_mask = np.array(True)
-    delivered_inst_lumi = np.array(delivered_inst_lumi)
-    delivered_unix_timestamp = np.array(delivered_unix_timestamp)
-
-    delivered_deltas = delivered_unix_timestamp[1:] - delivered_unix_timestamp[:-1]
-    delivered_mask = delivered_deltas < 600
-
-    delivered_run = np.logical_and(delivered_unix_timestamp[1:] > fill, delivered_mask)
-
-
-    return np.cumsum(
-        np.multiply(
-            delivered_deltas[delivered_run], delivered_inst_lumi[1:][delivered_run]
-        )
-    )[-1]/1e3
+    return getFillLumi(getFill(run), "atlas_lumi_hi")
 
 def getLumiSupertable(run: int) -> float:
-    runYear = getRunYear(run)
-    fill = getFill(run)
-
-    supertable = f"/eos/user/i/idioniso/1_Data/supertable{runYear}.csv"
-    st = pd.read_csv(supertable)
-    st['ATLAS Int. Lumi [1/nb]'] = st['ATLAS Int. Lumi [1/nb]'].astype(float)
-
-    row = st.loc[st['Fill'] == fill]
-
-    if row.empty:
-        return None
-
-    lumi_value = row['ATLAS Int. Lumi [1/nb]'].values[0]
-    fill_value = row['Fill'].values[0]
-
-    if pd.isna(lumi_value) or pd.isna(fill_value):
-        return None
-
-    lumi = st.loc[st['Fill'] == fill, 'ATLAS Int. Lumi [1/nb]'].values[0]
-    return lumi_value
+    return getSupertableStore().GetLumi(getFill(run), getRunYear(run))
+
+LUMI_SOURCES = {"eos": "atlas_lumi", "eos_hi": "atlas_lumi_hi", "st": None}
+
+def getLumiBatch(
+    runs: list,
+    sources: tuple = ("eos", "eos_hi", "st"),
+    nThreads: int = 16
+) -> pd.DataFrame:
+    """
+    Integrated luminosity of many runs from several sources at once.
+
+    Runs are grouped by fill and every needed per-fill luminosity file
+    (or supertable lookup) is read once, concurrently.
+
+    Args:
+        runs: Run numbers
+        sources: Any of 'eos' (atlas_lumi), 'eos_hi' (atlas_lumi_hi) and 'st' (supertable)
+        nThreads: Number of threads reading the luminosity files
+
+    Returns:
+        pd.DataFrame: Columns Run, Fill, Source and Lumi (NaN where unavailable)
+    """
+    for source in sources:
+        if source not in LUMI_SOURCES:
+            raise ValueError(f"Invalid source '{source}'! Allowed sources are: {', '.join(LUMI_SOURCES)}")
+
+    runs = [int(run) for run in runs]
+    fills = getFills(runs)
+    missing = [run for run, fill in fills.items() if fill is None]
+    if missing:
+        raise ValueError(f"Fill number not found for runs {missing}")
+
+    firstRuns = {}
+    for run in runs:
+        firstRuns.setdefault(fills[run], run)
+
+    def getFillSourceLumi(item):
+        fill, source = item
+        if LUMI_SOURCES[source] is None:
+            return getLumiSupertable(firstRuns[fill])
+        return getFillLumi(fill, LUMI_SOURCES[source])
+
+    tasks = [(fill, source) for fill in firstRuns for source in sources]
+    with ThreadPoolExecutor(max_workers=nThreads) as executor:
+        lumis = dict(zip(tasks, executor.map(getFillSourceLumi, tasks)))
+
+    rows = []
+    for run in runs:
+        for source in sources:
+            lumi = lumis[(fills[run], source)]
+            rows.append({
+                "Run": run,
+                "Fill": fills[run],
+                "Source": source,
+                "Lumi": np.nan if lumi is None else float(lumi)
+            })
+    return pd.DataFrame(rows, columns=["Run", "Fill", "Source", "Lumi"])
 
 def getLumi(run: int, option: str = "eos") -> float:
     if option.lower() in ["eos"]:
@@ -463,7 +400,7 @@ def getLumi(run: int, option: str = "eos") -> float:
 
 
 
-def getRunTimestamp(run: int, fromRoot: bool):
+def getRunTimestamp(run: int, fromRoot: bool = False):
     def getRunTimestampFromRoot(run: int):
         dir = getRunDirectory(run)
         tree = ROOT.TChain("cbmsim")
@@ -480,14 +417,9 @@ def getRunTimestamp(run: int, fromRoot: bool):
     else:
         fill = getFill(run)
         year = getRunYear(run)
-        supertable = f"/eos/user/i/idioniso/1_Data/supertable{year}.csv"
-        if os.path.exists(supertable):
-            st = pd.read_csv(supertable)
-
-            if fill in st['Fill'].values:
-                timestamp = st.loc[st['Fill'] == fill, 'Fill Start']
-                return int(timestamp.iloc[0])/1e3
-            return None
+        store = getSupertableStore()
+        if store.Exists(year):
+            return store.GetFillStart(fill, year)
         else:
             dir = getRunDirectory(run)
             tree = ROOT.TChain("cbmsim")
@@ -501,29 +433,15 @@ def getRunTimestamp(run: int, fromRoot: bool):
 
 
 def getRunDateFromRoot(run: int):
-    year = getRunYear(run)
-
-    inputDir = f"/eos/experiment/sndlhc/convertedData/physics/{year}/run_{run:06d}"
     try:
-        tfile = ROOT.TFile.Open(f"{inputDir}/sndsw_raw-0000.root")
+        metadata = getRunMetadata(getRunDirectory(run), "sndsw_raw-*.root")
     except Exception as e:
         print(f"Error opening file: {e}")
         return None
-    if tfile.Get("cbmsim"):
-        ttree = tfile.Get("cbmsim")
-    elif tfile.Get("rawConv"):
-        ttree = tfile.Get("rawConv")
-    else:
+    if metadata["tree"] is None:
         raise ValueError("No tree of name cbmsim/rawConv was found!")
 
-    try:
-        ttree.GetEntry(0)
-        utc_timestamp = ttree.EventHeader.GetUTCtimestamp()
-        date_ = datetime.datetime.utcfromtimestamp(utc_timestamp)
-        return date_
-    except Exception as e:
-        print(f"Error accessing data: {e}")
-        return None
+    return metadata["date"]
 
 def getRunDateFromSupertable(run: int):
     return datetime.datetime.fromtimestamp(getRunTimestamp(run), tz=datetime.timezone.utc)
@@ -542,66 +460,40 @@ def getRunDate(run: int, option: str = "st"):
 
 
 
-def getNewMFDF(mf):
-    fluxEosOg = {"v": { tt: [] for tt in (1, 11, 3, 13)}, "e": {tt: [] for tt in (1, 11, 3, 13)}}
-    fluxEosHi = {"v": { tt: [] for tt in (1, 11, 3, 13)}, "e": {tt: [] for tt in (1, 11, 3, 13)}}
-    fluxSt = {"v": { tt: [] for tt in (1, 11, 3, 13)}, "e": {tt: [] for tt in (1, 11, 3, 13)}}
-    for i in mf.index:
-        run = mf.at[i, "Run"]
+def getNewMFDF(mf, nTracks: pd.DataFrame):
+    tts = (1, 11, 3, 13)
+    runs = mf["Run"].to_numpy()
+    valid = runs != 10241
 
-        if run==10241:
-            for a in ("v", "e"):
-                for tt in (1, 11, 3, 13):
-                    fluxEosOg[a][tt].append(np.nan)
-                    fluxEosHi[a][tt].append(np.nan)
-                    fluxSt[a][tt].append(np.nan)
-            continue
+    counts = nTracks.drop_duplicates(subset="Run", keep="last").set_index("Run").reindex(runs)
+    N = counts[[f"nTracks{tt}" for tt in tts]].to_numpy(dtype=np.float64)
+    N[~valid] = np.nan
+    k = counts["scale"].to_numpy(dtype=np.float64)[:, None]
+    A = 928
+    dL = 0.035
 
-        N = {
-            tt: nTracks.loc[nTracks["Run"]==run, f"nTracks{tt}"].iloc[-1] for tt in (1, 11, 3, 13)
-        }
-        k = nTracks.loc[nTracks["Run"]==run, "scale"].iloc[-1]
-        A = 928
-        L_eos_og = getLumi(run, "eos")
-        L_eos_hi = getLumiEosHi(run)
-        L_st = getLumi(run, "st")
-        dL = 0.035
-        if getRunYear(run) == 2023:
-            eff = {
-                 "v": {1: 0.868, 11: 0.950, 3: 0.779, 13: 0.777},
-                 "e": {1: 0.009, 11: 0.010, 3: 0.011, 13: 0.020}
-             }
-        else:
-            eff = {
-                "v": {1: 0.790, 11: 0.864, 3: 0.723, 13: 0.755},
-                "e": {1: 0.066, 11: 0.059, 3: 0.069, 13: 0.062}
-            }
-
-        for tt in (1, 11, 3, 13):
-            flux, fluxErr = getFluxWithErr(N[tt], eff["v"][tt], L_eos_og, eff["e"][tt], dL, k, A)
-            fluxEosOg["v"][tt].append(flux)
-            fluxEosOg["e"][tt].append(fluxErr)
-            if L_st is not None:
-                flux, fluxErr = getFluxWithErr(N[tt], eff["v"][tt], L_st, eff["e"][tt], dL, k, A)
-                fluxSt["v"][tt].append(flux)
-                fluxSt["e"][tt].append(fluxErr)
-            else:
-                fluxSt["v"][tt].append(np.nan)
-                fluxSt["e"][tt].append(np.nan)
-            if L_eos_hi is not None:
-                flux, fluxErr = getFluxWithErr(N[tt], eff["v"][tt], L_eos_hi, eff["e"][tt], dL, k, A)
-                fluxEosHi["v"][tt].append(flux)
-                fluxEosHi["e"][tt].append(fluxErr)
-            else:
-                fluxEosHi["v"][tt].append(np.nan)
-                fluxEosHi["e"][tt].append(np.nan)
-
-    for tt in (1, 11, 3, 13):
-        mf[f"Flux{tt}_eos_og"] = fluxEosOg["v"][tt]
-        mf[f"FluxErr{tt}_eos_og"] = fluxEosOg["e"][tt]
-        mf[f"Flux{tt}_eos_hi"] = fluxEosHi["v"][tt]
-        mf[f"FluxErr{tt}_eos_hi"] = fluxEosHi["e"][tt]
-        mf[f"Flux{tt}_st"] = fluxSt["v"][tt]
-        mf[f"FluxErr{tt}_st"] = fluxSt["e"][tt]
+    is2023 = np.array([getRunYear(run) == 2023 if ok else False for run, ok in zip(runs, valid)])[:, None]
+    eff = np.where(is2023, [0.868, 0.950, 0.779, 0.777], [0.790, 0.864, 0.723, 0.755])
+    effErr = np.where(is2023, [0.009, 0.010, 0.011, 0.020], [0.066, 0.059, 0.069, 0.062])
+
+    # The same run can appear on several rows; look each one up once and broadcast back.
+    # Rows without a valid run (or a frame without any) get NaN luminosities.
+    sources = ["eos", "eos_hi", "st"]
+    lumiRuns = np.unique(runs[valid])
+    if len(lumiRuns):
+        lumis = getLumiBatch(lumiRuns, sources).pivot(index="Run", columns="Source", values="Lumi")
+    else:
+        lumis = pd.DataFrame(columns=sources, dtype=np.float64)
+    lumis = lumis.reindex(index=runs, columns=sources)
+
+    fluxes = {}
+    for name, source in (("eos_og", "eos"), ("eos_hi", "eos_hi"), ("st", "st")):
+        L = lumis[source].to_numpy(dtype=np.float64)[:, None]
+        fluxes[name] = getFluxArrays(N, eff, L, effErr, dL, k, A)[:2]
+
+    for i, tt in enumerate(tts):
+        for name in ("eos_og", "eos_hi", "st"):
+            mf[f"Flux{tt}_{name}"] = fluxes[name][0][:, i]
+            mf[f"FluxErr{tt}_{name}"] = fluxes[name][1][:, i]
 
     return mf
@@ -0,0 +1,265 @@
+import os
+import pickle
+import hashlib
+import numpy as np
+import ROOT
+import multiprocessing
+from time import time
+from typing import Union, Callable
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from ddfUtils import printStatusWithTime
+from utils.cache import writeAtomically
+from ddfRoot import DdfEff
+from utils.arrayEff import ArrayEff
+
+
+def mergeResults(a, b):
+    """
+    Merge two partial results of the same structure.
+
+    Histograms, TEfficiencies and ArrayEffs are added, DdfEff objects are
+    rebuilt from the summed passed/total histograms (or arrays), numbers
+    and numpy arrays are summed, dicts are merged key by key and
+    tuples/lists (e.g. passed/total pairs) element by element. `None` acts as the neutral element.
+    """
+    if a is None: return b
+    if b is None: return a
+
+    if isinstance(a, ArrayEff):
+        return a + b
+
+    elif isinstance(a, DdfEff) and "impl" not in a.__dict__ and "TEfficiency" not in a.__dict__:
+        return DdfEff(Array = a.Array + b.Array)
+
+    elif isinstance(a, DdfEff):
+        passed = a.Passed.Clone()
+        total = a.Total.Clone()
+        passed.Add(b.Passed)
+        total.Add(b.Total)
+        return DdfEff(
+            Passed = passed,
+            Total = total,
+            StatOption = getattr(a, "StatOption", "Clopper Pearson"),
+            CL = getattr(a, "CL", 0.682689),
+            Name = a.Name,
+            Title = a.Title
+        )
+
+    elif isinstance(a, (ROOT.TH1, ROOT.TEfficiency)):
+        a.Add(b)
+        return a
+
+    elif isinstance(a, dict):
+        merged = dict(a)
+        for key, value in b.items():
+            merged[key] = mergeResults(a.get(key), value)
+        return merged
+
+    elif isinstance(a, (tuple, list)):
+        if len(a) != len(b):
+            raise ValueError("Cannot merge sequences of different lengths!")
+        return type(a)(mergeResults(x, y) for x, y in zip(a, b))
+
+    elif isinstance(a, (int, float, np.number, np.ndarray)):
+        return a + b
+
+    else:
+        raise ValueError(f"Unsupported result type: {type(a)}")
+
+
+def treeReduce(results: list):
+    """
+    Merge a list of partial results pairwise, level by level.
+    """
+    results = list(results)
+    if not results:
+        return None
+
+    while len(results) > 1:
+        merged = [mergeResults(results[i], results[i+1]) for i in range(0, len(results) - 1, 2)]
+        if len(results) % 2:
+            merged.append(results[-1])
+        results = merged
+    return results[0]
+
+
+
+class Checkpoint:
+    """
+    Directory of pickled partial results, one per completed task.
+    """
+
+    def __init__(self, Directory: str):
+        self.Directory = Directory
+        os.makedirs(Directory, exist_ok=True)
+
+    def GetPath(self, key: str) -> str:
+        return os.path.join(self.Directory, f"{hashlib.md5(key.encode()).hexdigest()}.pkl")
+
+    def IsDone(self, key: str) -> bool:
+        return os.path.exists(self.GetPath(key))
+
+    def Save(self, key: str, result):
+        writeAtomically(self.GetPath(key), lambda f: pickle.dump({"key": key, "result": result}, f), binary=True)
+
+    def Load(self, key: str):
+        with open(self.GetPath(key), "rb") as f:
+            return pickle.load(f)["result"]
+
+
+
+def _runTask(func: Callable, key: str, args: tuple, checkpointDir: Union[str, None]):
+    result = func(*args)
+    if checkpointDir:
+        Checkpoint(checkpointDir).Save(key, result)
+        return None
+    return result
+
+
+def processFiles(
+    func: Callable,
+    files: Union[dict, list],
+    treeName: Union[str, None] = None,
+    nWorkers: Union[int, None] = None,
+    checkpointDir: Union[str, None] = None,
+    mpContext: Union[str, None] = None,
+    verbose: bool = True
+):
+    """
+    Map `func(file, treeName)` over files in a process pool and merge the
+    returned results (see mergeResults) with a tree reduction.
+
+    With `checkpointDir`, each file's result is stored on completion and
+    files already processed in a previous, interrupted job are skipped.
+
+    Args:
+        func: Picklable function processing a single file
+        files: List of files (with `treeName`) or a dict mapping file -> tree name
+        treeName: Tree name used when `files` is a list
+        nWorkers: Number of worker processes (default: number of cores)
+        checkpointDir: Directory for per-file results
+        mpContext: Multiprocessing start method ('fork', 'spawn', ...)
+        verbose: Print the progress
+
+    Returns:
+        The merged result over all files
+    """
+    if not isinstance(files, dict):
+        files = {file_: treeName for file_ in files}
+
+    checkpoint = Checkpoint(checkpointDir) if checkpointDir else None
+    todo = [f for f in files if not (checkpoint and checkpoint.IsDone(f))]
+    if verbose and checkpoint and len(todo) < len(files):
+        print(f"Resuming: {len(files) - len(todo)}/{len(files)} files were already processed.")
+
+    results = []
+    if todo:
+        context = multiprocessing.get_context(mpContext) if mpContext else None
+        start_time = time()
+        with ProcessPoolExecutor(max_workers=nWorkers, mp_context=context) as executor:
+            futures = [executor.submit(_runTask, func, f, (f, files[f]), checkpointDir) for f in todo]
+            for i, future in enumerate(as_completed(futures)):
+                result = future.result()
+                if checkpoint is None:
+                    results.append(result)
+                if verbose:
+                    printStatusWithTime(i, len(futures), start_time)
+
+    if checkpoint:
+        results = [checkpoint.Load(f) for f in files]
+
+    return treeReduce(results)
+
+
+
+def getShards(
+    nEntries: int,
+    nShards: Union[int, None] = None,
+    shardSize: Union[int, None] = None
+) -> list:
+    """
+    Split the entry range [0, nEntries) into contiguous shards.
+
+    Args:
+        nEntries: Total number of entries
+        nShards: Number of (nearly) equal shards
+        shardSize: Number of entries per shard (used if nShards is not given)
+
+    Returns:
+        list: (start, stop) entry ranges
+    """
+    if nShards is None and shardSize is None:
+        raise ValueError("Either the number of shards or the shard size has to be provided!")
+    if nEntries <= 0:
+        return []
+
+    if nShards is not None:
+        if nShards <= 0:
+            raise ValueError("The number of shards has to be positive!")
+        edges = np.linspace(0, nEntries, min(nShards, nEntries) + 1).round().astype(np.int64)
+    else:
+        if shardSize <= 0:
+            raise ValueError("The shard size has to be positive!")
+        edges = np.append(np.arange(0, nEntries, shardSize, dtype=np.int64), nEntries)
+
+    return [(int(start), int(stop)) for start, stop in zip(edges[:-1], edges[1:])]
+
+
+def processShards(
+    func: Callable,
+    shards: list,
+    checkpointDir: Union[str, None] = None,
+    nWorkers: Union[int, None] = None,
+    mpContext: Union[str, None] = None,
+    verbose: bool = True
+):
+    """
+    Run `func(start, stop)` for each entry-range shard and merge the results.
+
+    Each shard's result is checkpointed on completion, so a restarted job
+    continues after the last completed shard. Without `nWorkers` the shards
+    run in this process; otherwise they are farmed out to a process pool,
+    in which case `func` has to be picklable and open its own input.
+
+    Args:
+        func: Function processing the entries [start, stop)
+        shards: (start, stop) entry ranges, see getShards
+        checkpointDir: Directory for per-shard results
+        nWorkers: Number of worker processes (default: run serially)
+        mpContext: Multiprocessing start method ('fork', 'spawn', ...)
+        verbose: Print the progress
+
+    Returns:
+        The merged result over all shards
+    """
+    checkpoint = Checkpoint(checkpointDir) if checkpointDir else None
+    keys = {shard: f"{shard[0]}-{shard[1]}" for shard in shards}
+    todo = [shard for shard in shards if not (checkpoint and checkpoint.IsDone(keys[shard]))]
+    if verbose and checkpoint and len(todo) < len(shards):
+        print(f"Resuming: {len(shards) - len(todo)}/{len(shards)} shards were already processed.")
+
+    results = []
+    start_time = time()
+    if todo and nWorkers is None:
+        for i, shard in enumerate(todo):
+            result = _runTask(func, keys[shard], shard, checkpointDir)
+            if checkpoint is None:
+                results.append(result)
+            if verbose:
+                printStatusWithTime(i, len(todo), start_time)
+
+    elif todo:
+        context = multiprocessing.get_context(mpContext) if mpContext else None
+        with ProcessPoolExecutor(max_workers=nWorkers, mp_context=context) as executor:
+            futures = [executor.submit(_runTask, func, keys[shard], shard, checkpointDir) for shard in todo]
+            for i, future in enumerate(as_completed(futures)):
+                result = future.result()
+                if checkpoint is None:
+                    results.append(result)
+                if verbose:
+                    printStatusWithTime(i, len(futures), start_time)
+
+    if checkpoint:
+        results = [checkpoint.Load(keys[shard]) for shard in shards]
+
+    return treeReduce(results)
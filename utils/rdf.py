@@ -0,0 +1,155 @@
+import ROOT
+from typing import Union, Iterable
+from ddfRoot import DdfEff
+
+
+_helpersDeclared = False
+
+def _declareHelpers():
+    global _helpersDeclared
+    if _helpersDeclared:
+        return
+
+    ROOT.gInterpreter.Declare("""
+    int ddfCountTracks(const TClonesArray& tracks, int tt) {
+        int n = 0;
+        for (int i = 0; i < tracks.GetEntriesFast(); ++i) {
+            auto* track = static_cast<sndRecoTrack*>(tracks.UncheckedAt(i));
+            if (track && track->getTrackType() == tt) ++n;
+        }
+        return n;
+    }
+    """)
+    _helpersDeclared = True
+
+
+def enableMT(nThreads: int = 0):
+    """
+    Enable ROOT implicit multithreading (0 uses all available cores).
+    """
+    if ROOT.IsImplicitMTEnabled():
+        if nThreads == 0 or ROOT.GetThreadPoolSize() == nThreads:
+            return
+        ROOT.DisableImplicitMT()
+    ROOT.EnableImplicitMT(nThreads)
+
+
+def getRDataFrame(
+    tree: ROOT.TChain,
+    nThreads: Union[int, None] = None
+) -> ROOT.RDataFrame:
+    """
+    Build an RDataFrame over `tree`, with `EventHeader` and `Reco_MuonTracks`
+    available under their plain names.
+
+    Args:
+        tree: The TChain of a dataset
+        nThreads: If given, enable implicit multithreading with that many threads (0 for all cores)
+    """
+    if nThreads is not None:
+        enableMT(nThreads)
+
+    df = ROOT.RDataFrame(tree)
+    columns = [str(c) for c in df.GetColumnNames()]
+    for name in ("EventHeader", "Reco_MuonTracks"):
+        if name not in columns and f"{name}." in columns:
+            df = df.Alias(name, f"{name}.")
+    return df
+
+
+def filterIP1(df):
+    return df.Filter("EventHeader.isIP1()", "IP1")
+
+
+def defineTrackCounts(df, tts: Iterable[int] = (1, 11, 3, 13)):
+    """
+    Define an `nTracks{tt}` column with the number of reconstructed tracks
+    of each track type in the event.
+    """
+    _declareHelpers()
+    for tt in tts:
+        df = df.Define(f"nTracks{tt}", f"ddfCountTracks(Reco_MuonTracks, {tt})")
+    return df
+
+
+def getTrackCounts(df, tts: Iterable[int] = (1, 11, 3, 13), ip1: bool = False) -> dict:
+    """
+    Total number of reconstructed tracks per track type, in one event loop.
+    """
+    if ip1:
+        df = filterIP1(df)
+    df = defineTrackCounts(df, tts)
+
+    sums = {tt: df.Sum(f"nTracks{tt}") for tt in tts}
+    ROOT.RDF.RunGraphs(list(sums.values()))
+    return {tt: int(s.GetValue()) for tt, s in sums.items()}
+
+
+def getEffHists(
+    df,
+    model: tuple,
+    columns: Union[str, tuple],
+    passedFilter: str
+) -> tuple:
+    """
+    Book the passed and total histograms of an efficiency. Nothing is run
+    until the results are accessed.
+
+    Args:
+        df: RDataFrame (node) with the total selection applied
+        model: Histogram model (name, title, nBinsX, xlow, xhigh[, nBinsY, ylow, yhigh])
+        columns: Column (1D) or pair of columns (2D) to fill
+        passedFilter: Expression selecting the passed events
+
+    Returns:
+        tuple: (passed, total) RResultPtr histograms
+    """
+    if isinstance(columns, str):
+        columns = (columns,)
+
+    name, title, *binning = model
+    if len(columns) == 1:
+        passed = df.Filter(passedFilter).Histo1D(ROOT.RDF.TH1DModel(f"{name}_passed", title, *binning), *columns)
+        total  = df.Histo1D(ROOT.RDF.TH1DModel(f"{name}_total", title, *binning), *columns)
+    elif len(columns) == 2:
+        passed = df.Filter(passedFilter).Histo2D(ROOT.RDF.TH2DModel(f"{name}_passed", title, *binning), *columns)
+        total  = df.Histo2D(ROOT.RDF.TH2DModel(f"{name}_total", title, *binning), *columns)
+    else:
+        raise ValueError("Efficiencies can only be filled for one or two columns!")
+
+    return passed, total
+
+
+def getDdfEffs(
+    df,
+    effs: dict,
+    statOption: str = "Clopper Pearson",
+    cl: float = 0.682689
+) -> dict:
+    """
+    Fill several efficiencies in a single event loop.
+
+    Args:
+        effs: Mapping key -> (model, columns, passedFilter), see getEffHists
+
+    Returns:
+        dict: Mapping key -> DdfEff
+    """
+    def detach(hist):
+        hist = hist.GetValue().Clone()
+        hist.SetDirectory(ROOT.nullptr)
+        return hist
+
+    hists = {key: getEffHists(df, *args) for key, args in effs.items()}
+    ROOT.RDF.RunGraphs([h for pair in hists.values() for h in pair])
+
+    return {
+        key: DdfEff(
+            Passed = detach(passed),
+            Total = detach(total),
+            StatOption = statOption,
+            CL = cl,
+            Name = effs[key][0][0],
+            Title = effs[key][0][1]
+        ) for key, (passed, total) in hists.items()
+    }
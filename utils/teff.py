@@ -6,7 +6,7 @@ import pandas as pd
 from typing import Union
 from utils.th1 import isTH1, isTH2
 from utils.tgraph import getPandasFromTGraphAsymmErrors
-from ddfUtils import getEffWithError
+from utils.intervals import parseStatOption, getEffIntervals
 
 
 def getTEff(
@@ -35,52 +35,18 @@ def setStatOption(
     teff:       ROOT.TEfficiency,
     statOption: str = "normal"
 ):
-    statOption = statOption.lower()
-
-    normal_options           = {"normal", "kfnormal"}
-    clopper_pearson_options  = {"clopper_pearson", "kfcp", "clopper pearson",
-                                "clopper-pearson", "clopper.pearson",
-                                "clopper:pearson", "clopperpearson"}
-    bayesian_options         = {"bayesian", "kbbayesian"}
-    wilson_options           = {"wilson", "kfwilson"}
-    feldman_cousings_options = {"feldman_cousins", "kffc",
-                                "feldman cousins", "feldman-cousings",
-                                "feldman:cousins", "feldman.cousins",
-                                "feldmancousins"}
-    agresti_coull_options    = {"agresti_coull", "kfac",
-                                "agresti coull", "agresti-coull",
-                                "agresti:coull", "agresti.coull",
-                                "agresticoull"}
-    mid_p_interval_options   = {"mid_p_interval", "kmidp",
-                                "mid p interval", "mid-p-interval",
-                                "mid:p:interval", "mid.p.interval",
-                                "midpinterval"}
-    jeffrey_options          = {"jeffrey", "kbjeffrey"}
-    uniform_prior_options    = {"uniform_prior", "kbuniform",
-                                "uniform prior", "uniform-prior",
-                                "uniform:prior", "uniform.prior",
-                                "uniformprior"}
-
-    if statOption in normal_options:
-        teff.SetStatisticOption(ROOT.TEfficiency.kFNormal)
-    elif statOption in clopper_pearson_options:
-        teff.SetStatisticOption(ROOT.TEfficiency.kFCP)
-    elif statOption in bayesian_options:
-        teff.SetStatisticOption(ROOT.TEfficiency.kBBayesian)
-    elif statOption in wilson_options:
-        teff.SetStatisticOption(ROOT.TEfficiency.kFWilson)
-    elif feldman_cousings_options:
-        teff.SetStatisticOption(ROOT.TEfficiency.kFFC)
-    elif statOption in agresti_coull_options:
-        teff.SetStatisticOption(ROOT.TEfficiency.kFAC)
-    elif statOption in mid_p_interval_options:
-        teff.SetStatisticOption(ROOT.TEfficiency.kMidP)
-    elif statOption in jeffrey_options:
-        teff.SetStatisticOption(ROOT.TEfficiency.kBJeffrey)
-    elif statOption in uniform_prior_options:
-        teff.SetStatisticOption(ROOT.TEfficiency.kBUniform)
-
-    else: raise ValueError(f"Invalid statistic option '{statOption}'!")
+    statOptions = {
+        "normal":          ROOT.TEfficiency.kFNormal,
+        "clopper_pearson": ROOT.TEfficiency.kFCP,
+        "bayesian":        ROOT.TEfficiency.kBBayesian,
+        "wilson":          ROOT.TEfficiency.kFWilson,
+        "feldman_cousins": ROOT.TEfficiency.kFFC,
+        "agresti_coull":   ROOT.TEfficiency.kFAC,
+        "mid_p_interval":  ROOT.TEfficiency.kMidP,
+        "jeffrey":         ROOT.TEfficiency.kBJeffrey,
+        "uniform_prior":   ROOT.TEfficiency.kBUniform
+    }
+    teff.SetStatisticOption(statOptions[parseStatOption(statOption)])
 
 
 
@@ -339,11 +305,7 @@ def getPandasFromTEff1D(teff,
         x  = teff.member("fPassedHistogram").member("fXaxis").centers()
         ex = teff.member("fPassedHistogram").member("fXaxis").widths() / 2
 
-        y   = np.zeros(len(passed), dtype=np.float64)
-        eyh = np.zeros(len(passed), dtype=np.float64)
-        eyl = np.zeros(len(passed), dtype=np.float64)
-        for i in range(len(passed)):
-            y[i], eyh[i], eyl[i] = getEffWithError(passed[i], total[i], statOption=statOption, cl=cl)
+        y, eyh, eyl = getEffIntervals(passed, total, statOption=statOption, cl=cl)
 
         return pd.DataFrame({
             'x': x, 'y': y, 'exl': ex, 'exh': ex, 'eyl': eyl, 'eyh': eyh
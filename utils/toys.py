@@ -0,0 +1,212 @@
+import numpy as np
+import pandas as pd
+import multiprocessing
+from typing import Union
+from concurrent.futures import ProcessPoolExecutor
+from utils.flux import getFluxArrays, getCombinedFlux
+
+
+# Central 1-sigma interval and the median
+ONE_SIGMA_QUANTILES = (0.15865525393145707, 0.5, 0.8413447460685429)
+
+
+
+def generateFluxToys(
+    rng: np.random.Generator,
+    nToys: int,
+    N,
+    passed,
+    total,
+    L,
+    dL: float = 0.035,
+    rhoL: float = 0,
+    k = 1,
+    A: float = 928
+) -> np.ndarray:
+    """
+    Draw toy fluxes for all runs at once.
+
+    N is resampled from a Poisson distribution, the efficiency from its
+    beta posterior (uniform prior) and the luminosity from a Gaussian with
+    relative width `dL`. Scalar `passed`/`total` mean one efficiency shared
+    by all runs, so it is drawn once per toy. The luminosity fluctuations
+    of different runs are correlated with coefficient `rhoL`.
+
+    Returns:
+        np.ndarray: Toy fluxes of shape (nToys, nRuns)
+    """
+    N = np.asarray(N, dtype=np.float64)
+    L = np.asarray(L, dtype=np.float64)
+    passed = np.asarray(passed, dtype=np.float64)
+    total = np.asarray(total, dtype=np.float64)
+    nRuns = N.size
+
+    toyN = rng.poisson(N, size=(nToys, nRuns))
+
+    effShape = (nToys, 1) if passed.ndim == 0 and total.ndim == 0 else (nToys, nRuns)
+    toyEff = rng.beta(passed + 1, total - passed + 1, size=effShape)
+
+    z = np.sqrt(1 - rhoL) * rng.standard_normal((nToys, nRuns))
+    if rhoL > 0:
+        z += np.sqrt(rhoL) * rng.standard_normal((nToys, 1))
+    toyL = L * (1 + dL * z)
+
+    return (toyN * k) / (A * toyL * toyEff)
+
+
+
+def _fillHistograms(values: np.ndarray, lo: np.ndarray, width: np.ndarray, nBins: int) -> np.ndarray:
+    # Bin 0 is the underflow and bin nBins+1 the overflow of each run; the
+    # extra last column counts toys with exactly zero flux (N = 0), an atom
+    # of the distribution that is kept out of the histogram
+    nRuns = values.shape[1]
+    bins = np.floor((values - lo) / width).astype(np.int64) + 1
+    np.clip(bins, 0, nBins + 1, out=bins)
+    bins[values == 0] = nBins + 2
+    bins += np.arange(nRuns) * (nBins + 3)
+    return np.bincount(bins.ravel(), minlength=nRuns * (nBins + 3)).reshape(nRuns, nBins + 3)
+
+
+def _getHistogramQuantiles(hists: np.ndarray, lo: np.ndarray, width: np.ndarray, quantiles) -> np.ndarray:
+    nBins = hists.shape[1] - 3
+    norm = hists.sum(axis=1)
+    zeros = hists[:, -1] / norm
+    cdf = zeros[:, None] + np.cumsum(hists[:, :-1], axis=1) / norm[:, None]
+    rows = np.arange(hists.shape[0])
+
+    result = np.empty((hists.shape[0], len(quantiles)))
+    for i, q in enumerate(quantiles):
+        # First bin whose cumulative content reaches q, linearly interpolated inside it
+        j = np.clip(np.argmax(cdf >= q, axis=1), 1, nBins)
+        cdfLow = cdf[rows, j - 1]
+        content = hists[rows, j] / norm
+        with np.errstate(divide="ignore", invalid="ignore"):
+            frac = np.where(content > 0, (q - cdfLow) / content, 0.5)
+        value = lo + (j - 1 + np.clip(frac, 0, 1)) * width
+        # Quantiles inside the zero atom are exactly 0, and fluxes are never negative
+        result[:, i] = np.where(q <= zeros, 0.0, np.maximum(value, 0.0))
+    return result
+
+
+def _runToys(
+    seed: np.random.SeedSequence,
+    nToys: int,
+    batchSize: int,
+    inputs: dict,
+    weights: np.ndarray,
+    lo: np.ndarray,
+    width: np.ndarray,
+    nBins: int
+) -> tuple:
+    rng = np.random.default_rng(seed)
+    hists = np.zeros((len(lo), nBins + 3), dtype=np.int64)
+    combined = []
+
+    for start in range(0, nToys, batchSize):
+        toys = generateFluxToys(rng, min(batchSize, nToys - start), **inputs)
+        hists += _fillHistograms(toys, lo, width, nBins)
+        combined.append(toys @ weights)
+
+    return hists, np.concatenate(combined)
+
+
+
+def getFluxToyQuantiles(
+    N,
+    passed,
+    total,
+    L,
+    nToys: int = 100_000,
+    dL: float = 0.035,
+    rhoL: float = 0,
+    k = 1,
+    A: float = 928,
+    quantiles: tuple = ONE_SIGMA_QUANTILES,
+    index = None,
+    seed: Union[int, None] = None,
+    nWorkers: Union[int, None] = None,
+    batchSize: int = 10_000,
+    nBins: int = 4000,
+    mpContext: Union[str, None] = None
+) -> tuple:
+    """
+    Toy-MC quantiles of the per-run fluxes and of their combination.
+
+    The toys are generated in batches (see generateFluxToys) and reduced
+    on the fly: per-run quantiles come from fine histograms whose range is
+    set by a pilot batch, the combined flux (the generalized least-squares
+    mean of getFluxWithAllVariances, with weights fixed at the nominal
+    values) is kept toy by toy. Each worker gets an independent stream
+    spawned from `seed`, so results are reproducible for a given seed and
+    number of workers.
+
+    Args:
+        N: Number of tracks per run
+        passed: Passed events of the efficiency (scalar if shared by all runs)
+        total: Total events of the efficiency (scalar if shared by all runs)
+        L: Integrated luminosity per run
+        nToys: Number of toys
+        dL: Relative luminosity error (fraction from 0 to 1)
+        rhoL: Correlation of the luminosity errors between runs
+        k: Scale factor
+        A: Area
+        quantiles: Quantile levels to return
+        index: Index of the per-run DataFrame (e.g. run numbers)
+        seed: Seed of the random streams
+        nWorkers: Number of worker processes (default: run in this process)
+        batchSize: Number of toys generated at once
+        nBins: Number of histogram bins per run
+        mpContext: Multiprocessing start method ('fork', 'spawn', ...)
+
+    Returns:
+        tuple: (DataFrame of per-run quantiles, Series of combined-flux quantiles)
+    """
+    if not 0 <= dL <= 1:
+        raise ValueError("Luminosity error 'dL' have to be given as a fraction (from 0 to 1) of the total luminosity!")
+
+    N = np.atleast_1d(np.asarray(N, dtype=np.float64))
+    L = np.atleast_1d(np.asarray(L, dtype=np.float64))
+    inputs = {"N": N, "passed": passed, "total": total, "L": L, "dL": dL, "rhoL": rhoL, "k": k, "A": A}
+
+    passedArr, totalArr = np.asarray(passed, dtype=np.float64), np.asarray(total, dtype=np.float64)
+    eff = (passedArr + 1) / (totalArr + 2)
+    effErr = np.sqrt(eff * (1 - eff) / (totalArr + 3))
+    # Runs without tracks would have zero variance; weight them as if one track was seen
+    _, _, _, errN_2, errEff_2, errL_2 = getFluxArrays(np.maximum(N, 1), eff, L, effErr, dL, k, A)
+    flux = getFluxArrays(N, eff, L, effErr, dL, k, A)[0]
+    sharedEff = passedArr.ndim == 0 and totalArr.ndim == 0
+    weights = getCombinedFlux(flux, errN_2, errL_2, errEff_2, rhoL=rhoL, rhoEff=1 if sharedEff else 0)["weights"]
+
+    pilotSeed, workerSeed = np.random.SeedSequence(seed).spawn(2)
+    pilot = generateFluxToys(np.random.default_rng(pilotSeed), min(batchSize, nToys), **inputs)
+    pilotMin, pilotMax = pilot.min(axis=0), pilot.max(axis=0)
+    span = np.maximum(pilotMax - pilotMin, np.abs(flux) * 1e-6 + 1e-300)
+    lo = pilotMin - 0.5 * span
+    width = 2 * span / nBins
+
+    nChunks = max(nWorkers or 1, 1)
+    chunks = [len(c) for c in np.array_split(np.arange(nToys), nChunks) if len(c)]
+    seeds = workerSeed.spawn(len(chunks))
+    args = [(s, n, batchSize, inputs, weights, lo, width, nBins) for s, n in zip(seeds, chunks)]
+
+    if nWorkers is None:
+        results = [_runToys(*a) for a in args]
+    else:
+        context = multiprocessing.get_context(mpContext) if mpContext else None
+        with ProcessPoolExecutor(max_workers=nWorkers, mp_context=context) as executor:
+            results = list(executor.map(_runToys, *zip(*args)))
+
+    hists = sum(r[0] for r in results)
+    combined = np.concatenate([r[1] for r in results])
+
+    outOfRange = (hists[:, 0] + hists[:, -2]).sum() / hists.sum()
+    if outOfRange > min(quantiles) / 10:
+        print(f"Warning: {outOfRange:.2%} of the toys are outside the histogram range, quantiles may be inaccurate.")
+
+    runQuantiles = pd.DataFrame(
+        _getHistogramQuantiles(hists, lo, width, quantiles),
+        index = index,
+        columns = list(quantiles)
+    )
+    combinedQuantiles = pd.Series(np.quantile(combined, quantiles), index=list(quantiles))
+    return runQuantiles, combinedQuantiles